@@ -1,6 +1,10 @@
+import os
+import sys
 import pandas as pd
 import numpy as np
 import calendar
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import pipeline_io
 
 '''
 This script computes the classification group for each row in our data set.
@@ -11,7 +15,7 @@ in.
 '''
 
 # Read in the combined data set
-data = pd.read_csv('./2014_combined_final.csv')
+data = pipeline_io.load('./2014_combined_final.parquet')
 
 # We are only going to look at the neighborhoods in Manhattan
 data = data[data.nta.str.contains('MN')]
@@ -70,12 +74,12 @@ def ride_group(row):
 # Calculate the classification group for each row
 data['classification'] = data.apply(ride_group,axis=1)
 
-# Convert the date_hour columns to datetime
-data.date_hour = pd.to_datetime(data.date_hour)
 # Intialize a Calendar object
 cal = calendar.Calendar()
-# Determine the day of the week for each row (we will use this in our model)
+# Determine the day of the week for each row (we will use this in our model).
+# The date_hour column is loaded as datetimes (see pipeline_io.py).
 data['week_day'] = data.date_hour.dt.weekday
 
-# Save to a csv
-data.to_csv('2014_manhattan_classified.csv',index=False)
+# Save to a Parquet file, and to a csv for Tableau
+pipeline_io.save(data,'2014_manhattan_classified.parquet')
+pipeline_io.export_csv('2014_manhattan_classified.parquet','2014_manhattan_classified.csv')
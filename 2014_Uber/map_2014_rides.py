@@ -1,79 +1,120 @@
+import os
+import sys
+import collections
+import multiprocessing
 import pandas as pd
-import fiona
-import shapely
-import shapely.geometry
-import json
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import nta_locator
+import geocode_cache
+import pipeline_io
 
 '''
 This script finds the neighborhood that each ride in our 2014 data set
 originates from. To reduce computation time we only find the neighborhood for
 each unique latitude/longitude pair.
+
+Each month is read in chunks of chunk_size rides, and the chunks are mapped by a
+pool of worker processes that each load the NTA locator once. The mapped rides
+are written to one Parquet file per month in out_dir as they come back (each
+chunk is its own row group, see pipeline_io.py), so memory only depends on the
+chunk size and the number of workers, not the size of the data.
 '''
 
-# Read in the 2014 data
-apr = pd.read_csv('/Users/Brian/Downloads/Uber Data/2014/uber-raw-data-apr14.csv')
-may = pd.read_csv('/Users/Brian/Downloads/Uber Data/2014/uber-raw-data-may14.csv')
-jun = pd.read_csv('/Users/Brian/Downloads/Uber Data/2014/uber-raw-data-jun14.csv')
-jul = pd.read_csv('/Users/Brian/Downloads/Uber Data/2014/uber-raw-data-jul14.csv')
-aug = pd.read_csv('/Users/Brian/Downloads/Uber Data/2014/uber-raw-data-aug14.csv')
-sep = pd.read_csv('/Users/Brian/Downloads/Uber Data/2014/uber-raw-data-sep14.csv')
-# Combine the months into one DataFrame
-dfs = [apr,may,jun,jul,aug,sep]
-combined = pd.concat(dfs)
+# The folder with the raw 2014 data
+raw_dir = '/Users/Brian/Downloads/Uber Data/2014'
+# The months of 2014 data we have
+months = ['apr14','may14','jun14','jul14','aug14','sep14']
+# The folder we write the mapped rides of each month to
+out_dir = 'uber_2014_mapped'
+# The number of rides in each chunk
+chunk_size = 500000
+# The number of worker processes
+workers = multiprocessing.cpu_count()
+
+
+# The NTA locator and read only geocode cache of a worker process
+_locator = None
+_cache = None
+
+
+# This function runs once in each worker process and loads the NTA locator and
+# opens the geocode cache
+def _open_locator():
+    global _locator, _cache
+    # The shapes and grid are loaded from the binary bundle (which the main
+    # process makes sure is up to date). With this many points the grid of
+    # small cells means only points near a neighborhood boundary need to be
+    # tested against the shapes.
+    _locator = nta_locator.NTALocator.from_bundle()
+    _cache = geocode_cache.GeocodeCache(shapes_hash=_locator.shapes_hash,read_only=True)
+
+
+# This function finds the neighborhood of every ride in a chunk. It returns the
+# chunk with a new nta column, and the keys and codes of the pairs that weren't
+# in the cache yet so the main process can add them.
+def map_chunk(chunk):
+    # Encode each latitude/longitude pair as a single integer (the coordinates
+    # in fixed point with 6 decimal places), and get the unique pairs. inverse
+    # holds the position of each ride's pair in the unique pairs, and first
+    # holds the position of a ride with each unique pair.
+    keys = geocode_cache.coordinate_keys(chunk.Lat.values,chunk.Lon.values)
+    unique_keys, first, inverse = np.unique(keys,return_index=True,return_inverse=True)
+    # Read the pairs that were found in an earlier run (or by another script)
+    # from the geocode cache, and only locate the new pairs
+    found, unique_nta = _cache.get(unique_keys)
+    missing = ~found
+    unique_nta[missing] = _locator.locate(chunk.Lon.values[first[missing]],
+                                          chunk.Lat.values[first[missing]])
+    # Give each ride the neighborhood of its pair
+    chunk['nta'] = unique_nta[inverse.ravel()]
+    return chunk, unique_keys[missing], unique_nta[missing]
 
-# Combine the latitude and longitude into one column
-combined.Lat = combined.Lat.apply(lambda x: str(x))
-combined.Lon = combined.Lon.apply(lambda x: str(x))
-combined['lat_lon'] = combined['Lat'] + ' ' + combined['Lon']
 
-# Create a new DataFrame that has only the unique latitude/longitude pairs
-combined_unique = pd.DataFrame()
-combined_unique['lat_lon'] = combined.lat_lon.unique()
-# Re-split the latitude and longitude into two columns
-combined_unique['lat'] = combined_unique.lat_lon.apply(lambda x: float(x.split()[0]))
-combined_unique['lon'] = combined_unique.lat_lon.apply(lambda x: float(x.split()[1]))
+# This function adds a mapped chunk's new pairs to the geocode cache and writes
+# its rides to the month's file
+def _write_chunk(result,cache,writer):
+    chunk, new_keys, new_nta = result
+    if len(new_keys) > 0:
+        cache.put(new_keys,new_nta)
+    writer.write(chunk)
 
-# Open the GeoJSON file which contains our shapes
-with open('/Users/Brian/Uber_Project/Subway_Data/neighborhood_shapes.json','r') as f:
-    js = json.load(f)
 
-# Create a blank list to store our shapes
-shapes = []
-# Iterate through each feature and get its shape and NTA id code
-for feature in js['features']:
-    polygon = shapely.geometry.shape(feature['geometry'])
-    nta_id = feature['properties']['NTACode']
-    # Append our polygon and nta_id as a tuple
-    shapes.append((polygon,nta_id))
+# This function maps every month's rides in a pool of worker processes. At most
+# 2 chunks per worker are read ahead of the one being written, and the chunks of
+# each month are written in the order they were read.
+def map_months(months,raw_dir,out_dir,chunk_size,workers):
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    # Compile the shapes into a bundle if they changed since the last run
+    locator = nta_locator.load_bundle()
+    # Only the main process writes to the geocode cache. Opening it here also
+    # creates it before the workers open it.
+    cache = geocode_cache.GeocodeCache(shapes_hash=locator.shapes_hash)
+    pool = multiprocessing.Pool(workers,initializer=_open_locator)
+    try:
+        for month in months:
+            writer = pipeline_io.Writer(os.path.join(out_dir,'uber-%s.parquet' % month))
+            chunks = pd.read_csv(os.path.join(raw_dir,'uber-raw-data-%s.csv' % month),
+                                 chunksize=chunk_size)
+            # Close the month's file even if a chunk fails, so the rows that
+            # were already written are flushed and the file handle is released
+            try:
+                pending = collections.deque()
+                for chunk in chunks:
+                    pending.append(pool.apply_async(map_chunk,(chunk,)))
+                    if len(pending) >= 2*workers:
+                        _write_chunk(pending.popleft().get(),cache,writer)
+                while pending:
+                    _write_chunk(pending.popleft().get(),cache,writer)
+            finally:
+                writer.close()
+            print('Mapped %s' % month)
+    finally:
+        pool.close()
+        pool.join()
+        cache.close()
 
-# Iterate through the unique_stations
-def find_neighborhood(row):
-    # Get the longitude and latitude for this station
-    # Create a shapely point of this longitude/latitude
-    point = shapely.geometry.Point(row.lon,row.lat)
-    # Iterate through our list of shapes
-    for shape in shapes:
-        # Get the maximum and minimum values for latitude and longitude in this
-        # shape
-        minx, miny, maxx, maxy = shape[0].bounds
-        # Create a box which contains all points in that are within our maximums
-        # and minimums
-        bounding_box = shapely.geometry.box(minx, miny, maxx, maxy)
-        # Check to see if our point if within this box. If not, then the point
-        # can't be in the shape and we don't need to check if the point is in
-        # shape (which is more computationally expensive)
-        if bounding_box.contains(point):
-            # If the point is in the box, check if the point is in the shape
-            if shape[0].contains(point):
-                # Update the nta_id column for this row with the nta_id for this
-                # shape
-                # We found the NTA which contains this point so we can move on
-                # to the next point
-                return shape[1]
 
-# Find the neighborhood for each unique latitude/longitude pair
-combined_unique['nta'] = combined_unique.apply(find_neighborhood,axis=1)
-# Merge with the master 2014 DataFrame
-combined = combined.merge(combined_unique,on='lat_lon',how='outer')
-# Save to csv
-combined.to_csv('uber_2014_mapped.csv',index=False)
+if __name__ == '__main__':
+    map_months(months,raw_dir,out_dir,chunk_size,workers)
@@ -1,3 +1,5 @@
+import os
+import sys
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import StandardScaler
@@ -10,11 +12,13 @@ from sklearn.neighbors import KNeighborsClassifier
 from sklearn.svm import SVC
 from sklearn.ensemble import RandomForestClassifier, AdaBoostClassifier, GradientBoostingClassifier, VotingClassifier
 from sklearn.metrics import accuracy_score
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import pipeline_io
 
 # Read in our data
-data = pd.read_csv('/Users/Brian/Uber (not on github)/2014_manhattan_classified.csv')
+data = pipeline_io.load('/Users/Brian/Uber (not on github)/2014_manhattan_classified.parquet')
 # Drop the columns we won't use in our model
-data.drop(['date_hour','nta_dt','month','day','Unnamed: 0','nbhd_name','rides_pct'],axis=1,inplace=True)
+data.drop(['date_hour','month','day','Unnamed: 0','nbhd_name','rides_pct'],axis=1,inplace=True)
 
 # Select the features
 X = data[data.columns - ['classification']]
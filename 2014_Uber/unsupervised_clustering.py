@@ -1,3 +1,5 @@
+import os
+import sys
 import pandas as pd
 import numpy as np
 from sklearn import cluster
@@ -6,6 +8,8 @@ from sklearn.metrics import silhouette_score
 import matplotlib.pyplot as plt
 import warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import pipeline_io
 
 '''
 This script uses k-means clustering to determine the optimal number of clusters.
@@ -15,7 +19,7 @@ quantiles.
 '''
 
 # Read in the data
-data = pd.read_csv('./2014_combined_final.csv')
+data = pipeline_io.load('./2014_combined_final.parquet')
 
 # Encode the nta column
 le = LabelEncoder()
@@ -23,7 +27,7 @@ nta_encoded = le.fit_transform(data.nta)
 data['nta_encoded'] = nta_encoded
 
 # Drop the columns we won't use for our model
-data.drop(['nta','date_hour','nta_dt','nbhd_name','Unnamed: 0'],axis=1,inplace=True)
+data.drop(['nta','date_hour','nbhd_name','Unnamed: 0'],axis=1,inplace=True)
 
 # Scale our data (not every column needs to be scaled)
 to_scale = data[(data.columns-['month','day','hour','nta_encoded'])]
@@ -0,0 +1,240 @@
+import pandas as pd
+import numpy as np
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+'''
+This module distributes the number of entries in each turnstile report (which
+are each for 1 period, 3, 4, or 5 hours long) into 1 hour periods. Each
+turnstile has a fitted profile of its expected entries for every hour of the
+week (0 is Monday at 12am, 167 is Sunday at 11pm), and each report's entries
+are split between its hours in proportion to the profile. It is shared by the
+2014 and 2015 turnstile scripts.
+'''
+
+# The columns that identify a single turnstile
+turnstile_cols = ['c/a','unit','scp']
+# The number of hours in a week
+week_hours = 168
+
+
+# This function returns the Fourier basis for a weekly cycle, evaluated at every
+# hour of the week. The columns are 1, cos(w*h), sin(w*h), cos(2*w*h), ...
+# where w is one cycle per week.
+def fourier_basis(harmonics):
+    hours = np.arange(week_hours)*(2*np.pi/week_hours)
+    columns = [np.ones(week_hours)]
+    for k in range(1,harmonics+1):
+        columns.append(np.cos(k*hours))
+        columns.append(np.sin(k*hours))
+    return np.column_stack(columns)
+
+
+# This function gets the number of reports ('size'), the number of reports with
+# an entry_diff ('count'), and the sum of entry_diff for every turnstile and
+# week_hour with one groupby. Stats for different weeks can be added together.
+def weekly_hour_stats(turn1):
+    return turn1.groupby(turnstile_cols+['week_hour']).entry_diff.agg(['size','count','sum'])
+
+
+# This function fits a smooth weekly curve to the average entry_diff for every
+# hour of the week that each turnstile reports on, and returns the curves
+# evaluated at every hour of the week as a DataFrame with one row per turnstile
+# and one column per week_hour. Every turnstile is fit at once by stacking
+# their least squares problems on a shared Fourier basis, which (unlike a high
+# degree polynomial in week_hour) is well conditioned.
+def fit_weekly_profiles(turn1,harmonics=10,min_reports=5,min_points=15):
+    return fit_profiles_from_stats(weekly_hour_stats(turn1),harmonics,
+                                   min_reports,min_points)
+
+
+# This function fits the weekly curves from the stats returned by
+# weekly_hour_stats(), so curves can be refit without the rows they came from
+def fit_profiles_from_stats(stats,harmonics=10,min_reports=5,min_points=15):
+    stats = stats.reset_index()
+    turnstiles = stats.groupby(turnstile_cols).size().index
+    codes = turnstiles.get_indexer(pd.MultiIndex.from_arrays([stats[col].values for col in turnstile_cols]))
+    hours = stats.week_hour.values.astype(np.int64)
+    # Spread the stats into one row per turnstile and one column per week_hour
+    counts = np.zeros((len(turnstiles),week_hours))
+    means = np.full((len(turnstiles),week_hours),np.nan)
+    counts[codes,hours] = stats['size'].values
+    with np.errstate(divide='ignore',invalid='ignore'):
+        means[codes,hours] = stats['sum'].values/stats['count'].values
+    reported = counts > 0
+    usable = reported & ~np.isnan(means)
+    # Sometimes there are a small amount of reports for a specific hour. We
+    # only want to fit our curve on points that have a large number of
+    # reports, so we discard hours with 5 reports or less. If that doesn't
+    # leave enough data points to properly model all 7 days, we keep all
+    # week_hours regardless of how many reports that week_hour had.
+    points = usable & (counts > min_reports)
+    few_points = points.sum(axis=1) < min_points
+    points[few_points] = usable[few_points]
+    # Each turnstile gets 1/2 as many terms as the week_hours it reports on
+    # (and never more terms than data points), up to the number of terms in
+    # our basis
+    basis = fourier_basis(harmonics)
+    num_terms = np.minimum(np.minimum(reported.sum(axis=1)//2 + 1,points.sum(axis=1)),
+                           basis.shape[1])
+    terms = np.arange(basis.shape[1]) < num_terms[:,None]
+    # Build the normal equations for every turnstile at once, only using each
+    # turnstile's data points and terms
+    weights = points.astype(float)
+    lhs = np.einsum('th,hi,hj->tij',weights,basis,basis)
+    rhs = np.dot(weights*np.where(points,means,0),basis)
+    # Unused terms get an identity row so their coefficient solves to 0
+    lhs *= terms[:,:,None] & terms[:,None,:]
+    lhs[:,np.arange(basis.shape[1]),np.arange(basis.shape[1])] += ~terms
+    rhs *= terms
+    # A turnstile that only reports on a few week_hours can have terms that are
+    # the same at each of its data points (i.e. only week_hours 24 and 144,
+    # where the cosines repeat), which makes its equations singular. Those
+    # turnstiles are fit by least squares like np.polyfit does, so they don't
+    # stop the rest of the turnstiles from being fit.
+    full_rank = np.linalg.matrix_rank(lhs) == basis.shape[1]
+    coefs = np.zeros(rhs.shape)
+    coefs[full_rank] = np.linalg.solve(lhs[full_rank],rhs[full_rank][:,:,None])[:,:,0]
+    for t in np.flatnonzero(~full_rank):
+        coefs[t] = np.linalg.lstsq(lhs[t],rhs[t],rcond=None)[0]
+    return pd.DataFrame(np.dot(coefs,basis.T),index=turnstiles)
+
+
+# This function splits periods into hours using arrays. For each period it
+# takes the row number of its turnstile's profile (codes), the datetime64 of
+# the end of the period, the number of hours in the period, and the number of
+# entries. It returns the position of each new hour's period, the datetime64
+# of the hour, its hour of the week, and its share of the period's entries.
+def split_periods(codes,end_times,num_hours,entry_diff,profiles):
+    num_hours = np.where(np.isnan(num_hours),0,num_hours).astype(np.int64)
+    num_hours[num_hours < 0] = 0
+    # Repeat each period once for every hour it contains. h counts the hours
+    # back from the end of the period (0, 1, ...)
+    parent = np.repeat(np.arange(len(num_hours)),num_hours)
+    starts = np.cumsum(num_hours) - num_hours
+    h = np.arange(len(parent)) - starts[parent]
+    times = end_times.astype('datetime64[ns]')[parent] - h*np.timedelta64(1,'h')
+    # Get the hour of the week for each hour (1/1/1970 was a Thursday)
+    hours_since_epoch = times.astype('datetime64[h]').astype(np.int64)
+    week_hour = ((hours_since_epoch//24 + 3) % 7)*24 + hours_since_epoch % 24
+    # Get the expected number of entries for each hour. There can't be a
+    # negative number of entries, so negative predictions are set to 0.
+    # Periods for turnstiles without a profile get NaN.
+    codes = codes[parent]
+    has_profile = codes >= 0
+    hour_preds = np.full(len(parent),np.nan)
+    hour_preds[has_profile] = profiles[codes[has_profile],week_hour[has_profile]]
+    hour_preds = np.where(hour_preds < 0,0,hour_preds)
+    # Sum the expected number of entries for each hour in each period
+    periods_sum = np.bincount(parent,weights=hour_preds,minlength=len(num_hours))[parent]
+    # Compute the percent of entries each hour contributes to its period and
+    # multiply it by the actual number of entries in the period. If a period's
+    # sum is 0, every hour in it gets 0.
+    with np.errstate(divide='ignore',invalid='ignore'):
+        hour_diff = (hour_preds/periods_sum)*entry_diff[parent]
+    hour_diff = np.where(periods_sum != 0,hour_diff,0)
+    return parent, times, week_hour, hour_diff
+
+
+# This function splits the rows (which are sorted by turnstile) into at most
+# num_shards contiguous ranges that each hold whole turnstiles and roughly the
+# same number of hours. It returns the (start, stop) row positions of each
+# shard.
+def shard_bounds(codes,num_hours,num_shards):
+    if len(codes) == 0:
+        return []
+    # The row positions where a new turnstile starts
+    turnstile_starts = np.flatnonzero(np.r_[True,codes[1:] != codes[:-1]])
+    # The number of hours before each turnstile starts
+    hours_before = np.r_[0,np.cumsum(num_hours)]
+    total = hours_before[-1]
+    hours_before = hours_before[turnstile_starts]
+    # Cut at the turnstile starts closest to an equal share of the hours
+    targets = total*np.arange(1,num_shards)/float(num_shards)
+    cuts = np.r_[turnstile_starts,len(codes)][np.searchsorted(hours_before,targets)].tolist()
+    cuts = sorted(set([0] + [c for c in cuts if c > 0] + [len(codes)]))
+    return list(zip(cuts[:-1],cuts[1:]))
+
+
+# The memory-mapped input arrays of a worker process
+_shared = {}
+
+
+# This function runs once in each worker process and opens the input arrays
+# saved in folder as memory-mapped files, so the workers share them instead of
+# each getting its own copy
+def _open_shared(folder):
+    for name in ['codes','end_times','num_hours','entry_diff','profiles']:
+        _shared[name] = np.load(os.path.join(folder,name+'.npy'),mmap_mode='r')
+
+
+# This function splits the periods of one shard of rows into hours. The
+# position of each hour's period is returned relative to the whole input.
+def _split_shard(bounds):
+    start, stop = bounds
+    parent, times, week_hour, hour_diff = split_periods(
+        np.asarray(_shared['codes'][start:stop]),
+        np.asarray(_shared['end_times'][start:stop]),
+        np.asarray(_shared['num_hours'][start:stop]),
+        np.asarray(_shared['entry_diff'][start:stop]),_shared['profiles'])
+    return parent + start, times, week_hour, hour_diff
+
+
+# This function splits the periods in a pool of worker processes. Each worker
+# handles shards of whole turnstiles, and the results are put back together in
+# the same order as the shards, so the output doesn't depend on the number of
+# workers.
+def _split_in_pool(codes,end_times,num_hours,entry_diff,profiles,workers):
+    folder = tempfile.mkdtemp(prefix='hourly_')
+    try:
+        arrays = {'codes':codes,'end_times':end_times,'num_hours':num_hours,
+                  'entry_diff':entry_diff,'profiles':profiles}
+        for name, array in arrays.items():
+            np.save(os.path.join(folder,name+'.npy'),array)
+        # Use a few shards per worker so they all stay busy until the end
+        bounds = shard_bounds(codes,np.where(np.isnan(num_hours),0,num_hours),workers*4)
+        pool = multiprocessing.Pool(workers,initializer=_open_shared,initargs=(folder,))
+        try:
+            results = pool.map(_split_shard,bounds)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        shutil.rmtree(folder,ignore_errors=True)
+    if len(results) == 0:
+        return split_periods(codes,end_times,num_hours,entry_diff,profiles)
+    return tuple(np.concatenate(parts) for parts in zip(*results))
+
+
+# This function breaks down every row of turn1 into 1 hour periods using the
+# fitted profiles, and returns a DataFrame with one row per hour. turn1 needs
+# the turnstile, station, date_time, hours_since_last, and entry_diff columns.
+# The hours come out grouped by turnstile in the order of the profiles. With
+# workers > 1 the turnstiles are split between that many processes, and the
+# output is identical to running in a single process.
+def disaggregate_hourly(turn1,profiles,workers=1):
+    # Find the row of each report's turnstile in the profiles, and put the
+    # rows in the order of their turnstiles (keeping each turnstile's rows in
+    # their original order)
+    keys = pd.MultiIndex.from_arrays([turn1[col].values for col in turnstile_cols])
+    codes = profiles.index.get_indexer(keys)
+    order = np.argsort(codes,kind='mergesort')
+    inputs = (codes[order],
+              turn1.date_time.values.astype('datetime64[ns]')[order],
+              turn1.hours_since_last.values.astype(float)[order],
+              turn1.entry_diff.values.astype(float)[order],
+              np.ascontiguousarray(profiles.values,dtype=float))
+    if workers > 1:
+        parent, times, week_hour, hour_diff = _split_in_pool(*inputs,workers=workers)
+    else:
+        parent, times, week_hour, hour_diff = split_periods(*inputs)
+    hourly = turn1[turnstile_cols].iloc[order[parent]].reset_index(drop=True)
+    # Every turnstile gets the station, linename, and division of its c/a
+    stations = turn1.drop_duplicates('c/a').set_index('c/a')[['station','linename','division']]
+    hourly = hourly.join(stations,on='c/a')
+    hourly['date_time'] = times
+    hourly['entry_diff'] = hour_diff
+    hourly['hour_num'] = week_hour
+    return hourly
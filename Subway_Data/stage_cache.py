@@ -0,0 +1,101 @@
+import glob
+import hashlib
+import inspect
+import os
+import pandas as pd
+
+'''
+This module lets a long script be split into named stages whose outputs are
+saved to disk, so a re-run can pick up where the last run left off. Each stage's
+output is saved as a pickle file named after a hash of everything that goes into
+the stage: its name, parameters, source code, and the hashes of its inputs. If
+any of those change, the hash changes and the stage (and every stage after it)
+is run again. Stages whose saved output is still valid are skipped, and their
+inputs are never loaded. Only the latest output of each stage is kept, so the
+cache folder doesn't grow with every change.
+'''
+
+
+# This function returns the sha1 hash of a list of strings
+def _hash(parts):
+    sha = hashlib.sha1()
+    for part in parts:
+        sha.update(part.encode('utf-8') if not isinstance(part,bytes) else part)
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+# This function returns the sha1 hash of a file's contents
+def _file_hash(path):
+    sha = hashlib.sha1()
+    with open(path,'rb') as f:
+        for block in iter(lambda: f.read(1 << 20),b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+# This function returns the source code of a function. If the source isn't
+# available (i.e. the function was defined in an interactive session) its
+# compiled bytecode is used instead.
+def _source(func):
+    try:
+        return inspect.getsource(func)
+    except (IOError,TypeError):
+        return func.__code__.co_code + repr(func.__code__.co_consts).encode('utf-8')
+
+
+# This class is an input file of a pipeline. Its hash is the hash of the file's
+# contents and its output is the path of the file.
+class FileInput(object):
+    def __init__(self,path):
+        self.path = path
+        self.key = _file_hash(path)
+
+    def output(self):
+        return self.path
+
+
+# This class is one stage of a pipeline. func is called with the outputs of the
+# input stages (in order) and params as keyword arguments, and must return a
+# DataFrame. Any modules in depends are hashed along with func's source code,
+# so editing a helper function also re-runs the stage.
+class Stage(object):
+    def __init__(self,name,func,inputs=(),params=None,depends=(),
+                 cache_dir='stage_cache'):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = params or {}
+        self.cache_dir = cache_dir
+        sources = [_source(func)]
+        sources += [_file_hash(inspect.getsourcefile(module)) for module in depends]
+        self.key = _hash([name,repr(sorted(self.params.items()))] + sources +
+                         [stage.key for stage in self.inputs])
+        self.path = os.path.join(cache_dir,'%s_%s.pkl' % (name,self.key[:16]))
+
+    # This function returns the stage's output. The saved output is loaded if
+    # it exists, otherwise the input stages are loaded (or run) and this stage
+    # is run and its output saved.
+    def output(self):
+        if os.path.exists(self.path):
+            print('Loading stage %s from %s' % (self.name,self.path))
+            return pd.read_pickle(self.path)
+        args = [stage.output() for stage in self.inputs]
+        print('Running stage %s' % self.name)
+        result = self.func(*args,**self.params)
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # Save to a temporary file first so a crash while saving never leaves a
+        # partial file that looks valid
+        tmp_path = self.path + '.tmp'
+        result.to_pickle(tmp_path)
+        os.rename(tmp_path,self.path)
+        self.remove_old_outputs()
+        return result
+
+    # This function deletes the outputs this stage saved under other hashes
+    def remove_old_outputs(self):
+        pattern = os.path.join(self.cache_dir,'%s_%s.pkl' % (self.name,'[0-9a-f]'*16))
+        for path in glob.glob(pattern):
+            if path != self.path:
+                os.remove(path)
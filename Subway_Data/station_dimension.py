@@ -0,0 +1,100 @@
+import os
+import sys
+import pandas as pd
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import nta_locator
+import geocode_cache
+
+'''
+This module builds the station dimension table, which has one row per subway
+station:
+
+  station_id    an integer id for the station
+  station_line  the station's name and lines (i.e. '14 ST-UNION SQ 456LNQR'),
+                which is how the turnstile data identifies a station
+  longitude, latitude
+  nta_id        the NTA id code the station is located in
+
+It is built once from subway_stations_nyc_matched.csv and saved to
+station_dimension.csv. The hourly turnstile data only stores each row's
+station_id, and joins to this table for the station's location and
+neighborhood.
+'''
+
+# There are some issues where the same station has multiple station_lines
+# Create a dictionary to map the issues to their main station_line
+linename_map = {'14 ST-UNION SQ LNQR456':'14 ST-UNION SQ 456LNQR',
+                '157 ST 1.0':'157 ST 1',
+                '168 ST-BROADWAY AC1':'168 ST-BROADWAY 1AC',
+                '34 ST-PENN STA 123ACE':'34 ST-PENN STA 123',
+                '42 ST-PA BUS TE ACENGRS1237':'42 ST-PA BUS TE ACENQRS1237',
+                '42 ST-TIMES SQ ACENQRS1237':'42 ST-TIMES SQ 1237ACENQRS',
+                '59 ST-COLUMBUS ABCD1':'59 ST-COLUMBUS 1ABCD',
+                'BARCLAYS CENTER BDNQR2345':'BARCLAYS CENTER 2345BDNQR',
+                'BOROUGH HALL/CT R2345':'BOROUGH HALL/CT 2345R',
+                'FULTON ST ACJZ2345':'FULTON ST 2345ACJZ',
+                'WALL ST 45.0':'WALL ST 45'}
+
+
+# This function combines the turnstile data's station names and linenames into
+# station_lines. Linenames that are only numbers were read in as floats (i.e.
+# 45.0), so they are converted back to the original string. The duplicate
+# station_lines are mapped to their main station_line.
+def station_lines(station,linename):
+    linename = linename.astype(str).str.replace(r'\.0$','',regex=True)
+    station_line = station.astype(str) + ' ' + linename
+    return station_line.map(linename_map).fillna(station_line)
+
+
+# This function builds the station dimension table from the csv which has
+# station names and their latitude/longitude
+def build_station_dimension(stations_path='./subway_stations_nyc_matched.csv',
+                            shapes_path='./neighborhood_shapes.json'):
+    stations = pd.read_csv(stations_path)
+    # Format the station name and line and combine in the same format of the
+    # station_line column of the turnstile data
+    station_line = (stations.NAME.str.upper() + ' ' +
+                    stations.LINE.str.replace('-','',regex=False))
+    # Get longitude/latitude from the combined column (i.e. 'POINT (-73.97 40.80)')
+    coords = stations.the_geom.str.extract(r'POINT \(([-\d.]+) ([-\d.]+)\)').astype(float)
+    dimension = pd.DataFrame({'station_line':station_line,
+                              'longitude':coords[0],
+                              'latitude':coords[1]})
+    # Keep a single row for each station_line
+    dimension = dimension.drop_duplicates('station_line').reset_index(drop=True)
+    dimension.insert(0,'station_id',np.arange(len(dimension)))
+    # Find the NTA id code each station is located in, for every station at
+    # once. Stations that were already located are read from the shared
+    # geocode cache.
+    locator = nta_locator.load_bundle(path=shapes_path)
+    cache = geocode_cache.GeocodeCache(shapes_hash=locator.shapes_hash)
+    dimension['nta_id'] = cache.locate(locator,dimension.longitude.values,
+                                       dimension.latitude.values)
+    cache.close()
+    return dimension
+
+
+# This function loads the station dimension table, building and saving it
+# first if it doesn't exist yet
+def load_station_dimension(path='./station_dimension.csv',**kwargs):
+    if not os.path.exists(path):
+        build_station_dimension(**kwargs).to_csv(path,index=False)
+    return pd.read_csv(path)
+
+
+# This function returns the station_id of each turnstile row's station and
+# linename, or -1 for stations that aren't in the dimension table
+def station_ids(station,linename,dimension):
+    # Only normalize each distinct station and linename once
+    pairs = pd.DataFrame({'station':station.values,'linename':linename.values}).fillna('')
+    codes = pairs.groupby(['station','linename'],sort=False).ngroup().values
+    uniques = pairs.drop_duplicates()
+    rows = pd.Index(dimension.station_line).get_indexer(
+        station_lines(uniques.station,uniques.linename))
+    ids = np.where(rows >= 0,dimension.station_id.values[rows],-1)
+    return ids[codes]
+
+
+if __name__ == '__main__':
+    load_station_dimension()
@@ -0,0 +1,255 @@
+import pandas as pd
+import numpy as np
+
+'''
+This module contains the cleaning steps for the turnstile data that are shared
+by our cleaning scripts. Each function works on the whole DataFrame at once
+instead of looping through the turnstiles one at a time.
+'''
+
+# The columns that identify a single turnstile
+turnstile_cols = ['c/a','unit','scp']
+
+
+# The divisions that aren't subway lines: the Roosevelt Island Tram, the LIRR,
+# PATH, and the Staten Island Railway
+other_divisions = ['RIT','LIB','PTH','SRT']
+
+
+# This function calculates how many 4 hour periods have passed since the last
+# report from a turnstile, for a single timedelta or a whole column of them.
+# The whole hours since the last report are divided into 4 hour periods and
+# rounded down.
+def num_periods(time):
+    return (time // np.timedelta64(1,'h')) // 4
+
+
+# There are some rows where it looks like there was an error with the turnstile
+# which results in a negative number of entries. This function sets them to NaN
+# so they get imputed. Rows on or before after are left alone (the first rows
+# of our 2015 data set compare different turnstiles and are dropped later).
+# The DataFrame is updated in place and also returned.
+def reset_negative_diffs(turn1,after='2014-12-28'):
+    turn1.loc[(turn1.entry_diff<0)&(turn1.date_time>pd.Timestamp(after)),'entry_diff'] = np.nan
+    return turn1
+
+
+# Sometimes a turnstile reports an abnormally large number of entries, but a
+# turnstile that doesn't report for a couple of days has a large entry_diff
+# that is still accurate. This function resets (to NaN) the entry_diffs of
+# more than 4000 people in less than 12 hours, and of more than 2000 people
+# every 4 hours when the time since the last report is more than 8 hours. It
+# also adds the num_periods column. The DataFrame is updated in place and also
+# returned.
+def reset_large_diffs(turn1):
+    turn1.loc[(turn1.entry_diff>4000)&(turn1.time_since_last<np.timedelta64(12,'h')),'entry_diff'] = np.nan
+    turn1['num_periods'] = num_periods(turn1['time_since_last'])
+    avg_ent = turn1['entry_diff']/turn1['num_periods']
+    turn1.loc[(avg_ent>2000)&(turn1.time_since_last>pd.Timedelta('08:00:00')),'entry_diff'] = np.nan
+    return turn1
+
+
+# There are some rows that are for more than 14 days worth of 4 hour periods but
+# have an entry_diff of less than 50. The max entry_diff per 1 hour period these
+# rows could have is .42 people. Since these rows are very computationally
+# expensive and have such small entry_diff values (and are potentially system
+# errors) this function sets their entry_diff to 0. The DataFrame is updated in
+# place and also returned.
+def zero_long_small_diffs(turn1):
+    turn1.loc[(turn1.num_periods>1)&(turn1.entry_diff.notnull())&
+              (turn1.time_since_last>pd.Timedelta('14 days'))&(turn1.entry_diff<50),'entry_diff'] = 0
+    return turn1
+
+
+# This function returns only the rows of the subway turnstiles (see
+# other_divisions), with a new index
+def drop_other_divisions(turn1):
+    return turn1[~turn1.division.isin(other_divisions)].reset_index(drop=True)
+
+
+# Sometimes a turnstile reports both a REGULAR and a RECOVER AUD or some other
+# 'desc' type at the same time. This function combines them into a single row
+# for that time. The REGULAR row is kept and its entry_diff becomes the sum of
+# both rows' entry_diffs, and the other row is dropped.
+# turn1 must already have its entry_diff column. The DataFrame is updated in
+# place and also returned.
+def collapse_duplicate_reports(turn1):
+    keys = turnstile_cols + ['date','time']
+    # Get every row whose turnstile reports more than once at the same time
+    dups = turn1.loc[turn1.duplicated(subset=keys,keep=False),keys+['desc','entry_diff']]
+    if len(dups) == 0:
+        return turn1
+    # For each duplicated time get the first 'REGULAR' row and the first row
+    # of any other 'desc' type
+    is_reg = dups.desc == 'REGULAR'
+    reg = dups[is_reg].groupby(keys,sort=False).head(1)
+    rec = dups[~is_reg].groupby(keys,sort=False).head(1)
+    # Line up each REGULAR row with the other row for the same time. The index
+    # of both rows is kept so we can update and drop them in turn1.
+    pairs = reg.drop('desc',axis=1).reset_index().merge(
+        rec.drop('desc',axis=1).reset_index(),on=keys,suffixes=('_reg','_rec'))
+    reg_diff = pairs.entry_diff_reg.values
+    rec_diff = pairs.entry_diff_rec.values
+    # If they have different signs, then the one that is negative is an error
+    # and we need to set that value equal to 0
+    new_reg = np.where((reg_diff < 0) & (rec_diff > 0),0,reg_diff)
+    new_rec = np.where((reg_diff > 0) & (rec_diff < 0),0,rec_diff)
+    # Set the entry_diff of the 'REGULAR' row to the sum of the two rows and
+    # drop the other row
+    turn1.loc[pairs.index_reg.values,'entry_diff'] = new_reg + new_rec
+    turn1.drop(pairs.index_rec.values,axis=0,inplace=True)
+    return turn1
+
+
+# The corrections that can be applied to a broken turnstile's entry_diffs, in
+# the order they are applied
+error_actions = [('abs',np.abs),
+                 ('zero',lambda x: np.zeros(len(x))),
+                 ('nan',lambda x: np.full(len(x),np.nan))]
+
+
+# This function reads in the turnstile error rules. Each row of the file is a
+# turnstile (c/a, unit, scp), an optional start and end date (a blank date
+# means the rule has no limit on that side), and the action to apply to that
+# turnstile's entry_diffs:
+#   abs  - replace negative entry_diffs with their absolute values
+#   zero - set every entry_diff to 0
+#   nan  - set every entry_diff to NaN so it gets imputed later
+def load_error_rules(path='./turnstile_error_rules.csv'):
+    rules = pd.read_csv(path,dtype=str)
+    unknown = set(rules.action) - set(action for action, correct in error_actions)
+    if unknown:
+        raise ValueError('Unknown turnstile error actions: %s' % ', '.join(sorted(unknown)))
+    rules['start'] = pd.to_datetime(rules['start'])
+    rules['end'] = pd.to_datetime(rules['end'])
+    return rules[turnstile_cols+['start','end','action']]
+
+
+# This function applies every error rule to turn1 in a single pass. The rules
+# are joined to the rows of the turnstiles they cover, and the rows inside each
+# rule's date range are corrected all at once for each action. The DataFrame is
+# updated in place and also returned.
+def apply_error_rules(turn1,rules):
+    rows = turn1[turnstile_cols+['date_time']].reset_index().merge(rules,on=turnstile_cols)
+    # Only keep the rows that fall inside their rule's date range
+    in_range = ((rows.start.isnull() | (rows.date_time >= rows.start)) &
+                (rows.end.isnull() | (rows.date_time <= rows.end)))
+    rows = rows[in_range]
+    for action, correct in error_actions:
+        index = rows.loc[rows.action == action,'index'].values
+        if len(index) > 0:
+            turn1.loc[index,'entry_diff'] = correct(turn1.loc[index,'entry_diff'].values)
+    return turn1
+
+
+# This function builds a profile table of the mean and count of entry_diff for
+# every group of keys (i.e. a turnstile or a unit) on each day of the week and
+# reporting time. Only rows with an original (not imputed) entry_diff for a
+# single 4 hour period are used.
+def build_profile_table(turn1,keys=turnstile_cols):
+    observed = turn1[(turn1.entry_diff.notnull())&(turn1.num_periods==1)]
+    if 'imputed' in observed:
+        observed = observed[observed.imputed==0]
+    return observed.groupby(keys+['day_num','time']).entry_diff.agg(['mean','count'])
+
+
+# This function predicts a value for every row with a NaN entry_diff for a
+# single 4 hour period, using the profile tables for each turnstile and unit.
+# For each of these rows:
+# - If it is the only row for its turnstile, there is no useful data for this
+#   turnstile and the row is dropped.
+# - If every entry_diff for its turnstile is 0, the entry_diff is set to 0.
+# - If its turnstile has at least 5 reports on the same day of the week and
+#   time, the entry_diff is set to their mean.
+# - Else if its unit has at least 5 reports on the same day of the week and
+#   time, the entry_diff is set to their mean.
+# - Else we don't have enough data for a reliable prediction and the
+#   entry_diff is set to 0.
+# Every predicted row gets imputed = 1. The DataFrame is updated in place and
+# also returned. The profile tables and the number of rows ('size') and sum of
+# entry_diff ('sum') for each turnstile (totals) can be passed in to predict
+# from more data than is in turn1.
+def impute_missing(turn1,scp_profiles=None,unit_profiles=None,totals=None):
+    if scp_profiles is None:
+        scp_profiles = build_profile_table(turn1,turnstile_cols)
+    if unit_profiles is None:
+        unit_profiles = build_profile_table(turn1,['c/a','unit'])
+    missing = turn1.loc[(turn1.entry_diff.isnull())&(turn1.num_periods==1),
+                        turnstile_cols+['day_num','time']]
+    if len(missing) == 0:
+        return turn1
+    # Get the number of rows and the sum of entry_diff for each turnstile
+    if totals is None:
+        totals = turn1.groupby(turnstile_cols).entry_diff.agg(['size','sum'])
+    # Look up each missing row's turnstile totals and profiles. A left merge
+    # keeps the rows in the same order as missing.
+    rows = missing.reset_index().merge(totals[['size','sum']].reset_index(),
+                                       on=turnstile_cols,how='left')
+    rows = rows.merge(scp_profiles[['mean','count']].reset_index(),how='left',
+                      on=turnstile_cols+['day_num','time'])
+    rows = rows.merge(unit_profiles[['mean','count']].reset_index(),how='left',
+                      on=['c/a','unit','day_num','time'],suffixes=('','_unit'))
+    scp_count = rows['count'].fillna(0).values
+    unit_count = rows['count_unit'].fillna(0).values
+    predicted = np.where(rows['sum'].values == 0,0,
+                np.where(scp_count >= 5,rows['mean'].values,
+                np.where(unit_count >= 5,rows['mean_unit'].values,0)))
+    only_row = rows['size'].values == 1
+    keep = rows.loc[~only_row,'index'].values
+    turn1.loc[keep,'entry_diff'] = predicted[~only_row]
+    turn1.loc[keep,'imputed'] = 1
+    turn1.drop(rows.loc[only_row,'index'].values,axis=0,inplace=True)
+    return turn1
+
+
+# For rows that cover more than 1 period, we need to break them down into
+# multiple 4 hour periods. This function creates a new row for each 4 hour
+# period after the turnstile's previous report, for every multiple period row
+# at once. The row's entry_diff is distributed between its new rows in
+# proportion to the turnstile's average entry_diff on that day of the week and
+# time, which is looked up in the profile table. It returns a DataFrame of the
+# new rows with the same columns as turn1.
+def explode_multi_period(turn1,scp_profiles=None):
+    if scp_profiles is None:
+        scp_profiles = build_profile_table(turn1)
+    # Each new period starts from the date_time of the row before it
+    prev_date_time = turn1.date_time.shift(1)
+    multi = ((turn1.num_periods>1)&(turn1.entry_diff.notnull())).values
+    parents = turn1[multi]
+    periods = parents.num_periods.values.astype(np.int64)
+    # Repeat each multiple period row once for each period it contains. parent
+    # is the position of each new row's original row in parents, and step is
+    # the number of 4 hour periods since the previous report (1, 2, ...)
+    parent = np.repeat(np.arange(len(parents)),periods)
+    starts = np.cumsum(periods) - periods
+    step = np.arange(len(parent)) - starts[parent] + 1
+    date_time = pd.Series(prev_date_time.values[multi][parent] +
+                          step*np.timedelta64(4,'h'))
+    new = parents[turnstile_cols+['station','linename','division']].iloc[parent]
+    new.reset_index(drop=True,inplace=True)
+    new['date'] = date_time.dt.strftime('%m-%d-%Y')
+    new['time'] = date_time.dt.strftime('%H:00:00')
+    new['desc'] = 'IMPUTED'
+    new['entries'] = np.nan
+    new['exits'] = np.nan
+    new['date_time'] = date_time
+    new['time_since_last'] = pd.Timedelta('4 hours')
+    new['num_periods'] = 1
+    new['day_num'] = date_time.dt.weekday
+    new['imputed'] = 1
+    # Get the turnstile's average entry_diff on each new row's day and time
+    averages = new[turnstile_cols+['day_num','time']].merge(
+        scp_profiles[['mean']].reset_index(),how='left',
+        on=turnstile_cols+['day_num','time'])['mean'].values
+    # Sum the averages of each original row's periods. If any of them is NaN
+    # the sum is NaN, and so are the predictions for that row.
+    averages_total = np.bincount(parent,weights=averages,minlength=len(parents))[parent]
+    total_entries = parents.entry_diff.values[parent]
+    # Calculate the percent each period contributes to the total average
+    # entry_diff over the total time period and multiply it by the total
+    # entries. If the total entries or the sum of the averages is 0, each
+    # period gets 0.
+    with np.errstate(divide='ignore',invalid='ignore'):
+        predicted = (averages/averages_total)*total_entries
+    new['entry_diff'] = np.where((total_entries == 0)|(averages_total == 0),0,predicted)
+    return new[turn1.columns]
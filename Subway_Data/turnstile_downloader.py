@@ -0,0 +1,141 @@
+import hashlib
+import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+try:
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.request import urlopen
+
+'''
+This module downloads the MTA's weekly turnstile files. Weeks are fetched
+concurrently by a pool of threads, and a rate limiter spaces out the requests so
+we don't overload the server. Every file we download is saved in an on-disk
+cache so it never has to be downloaded again:
+
+  cache_dir/objects/<sha1 of the file>  holds the raw contents of a file
+  cache_dir/dates/<yymmdd>              holds the sha1 of that week's file
+
+Because the cache is keyed by date, a crawl can be re-run offline from the cache
+alone. To test against a local stand-in for the MTA's server, serve a folder of
+turnstile_yymmdd.txt files (i.e. python -m SimpleHTTPServer) and pass its
+address as url_head.
+'''
+
+# Define the head of the url we will be crawling through
+url_head = 'http://web.mta.info/developers/data/nyct/turnstile/turnstile_'
+
+
+# This class makes sure we start at most `rate` requests per second, no matter
+# how many threads are downloading at once. A rate of None or 0 means there is
+# no limit.
+class RateLimiter(object):
+    def __init__(self,rate):
+        self.interval = 1.0/rate if rate else 0.
+        self.lock = threading.Lock()
+        self.next_time = 0.
+
+    def wait(self):
+        # Reserve the next open time slot and then sleep until it arrives
+        with self.lock:
+            now = time.time()
+            start = max(now,self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+# This function returns the url of the turnstile file for the week ending on
+# the Saturday d
+def week_url(d,head=url_head):
+    return head + d.strftime('%y%m%d') + '.txt'
+
+
+# This function returns the path of the file that stores the sha1 of the week
+# ending on d
+def _date_path(d,cache_dir):
+    return os.path.join(cache_dir,'dates',d.strftime('%y%m%d'))
+
+
+# This function returns the path of the file that stores the contents with a
+# given sha1
+def _object_path(sha,cache_dir):
+    return os.path.join(cache_dir,'objects',sha)
+
+
+# This function writes data to path by writing to a temporary file first and
+# then renaming it, so a crash never leaves a partially written file behind
+def _atomic_write(path,data):
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            # Another thread may have created the folder at the same time
+            if not os.path.isdir(folder):
+                raise
+    tmp_path = '%s.%d.%d.tmp' % (path,os.getpid(),threading.current_thread().ident)
+    with open(tmp_path,'wb') as f:
+        f.write(data)
+    os.rename(tmp_path,path)
+
+
+# This function returns the raw contents of the week ending on d from the cache,
+# or None if the week hasn't been cached (or the cached file is corrupted)
+def read_cached(d,cache_dir):
+    date_path = _date_path(d,cache_dir)
+    if not os.path.exists(date_path):
+        return None
+    with open(date_path,'r') as f:
+        sha = f.read().strip()
+    object_path = _object_path(sha,cache_dir)
+    if not os.path.exists(object_path):
+        return None
+    with open(object_path,'rb') as f:
+        raw = f.read()
+    # Make sure the contents still match their address
+    if hashlib.sha1(raw).hexdigest() != sha:
+        return None
+    return raw
+
+
+# This function saves the raw contents of the week ending on d to the cache and
+# returns their sha1
+def write_cached(d,raw,cache_dir):
+    sha = hashlib.sha1(raw).hexdigest()
+    object_path = _object_path(sha,cache_dir)
+    # Identical files only need to be stored once
+    if not os.path.exists(object_path):
+        _atomic_write(object_path,raw)
+    _atomic_write(_date_path(d,cache_dir),sha.encode('ascii'))
+    return sha
+
+
+# This function makes sure the week ending on d is in the cache, downloading it
+# if it isn't there yet. In offline mode a week that isn't cached is an error.
+def fetch_week(d,cache_dir,limiter,head=url_head,offline=False):
+    if read_cached(d,cache_dir) is not None:
+        return d
+    if offline:
+        raise IOError('Week ending %s is not in the cache at %s' % (d,cache_dir))
+    # Wait for our turn so we don't overload the server
+    limiter.wait()
+    raw = urlopen(week_url(d,head)).read()
+    write_cached(d,raw,cache_dir)
+    return d
+
+
+# This function makes sure every week in dates is in the cache. Weeks that are
+# missing are downloaded by `workers` threads at no more than `rate` requests
+# per second. It returns the dates in the same order they were given.
+def download_weeks(dates,cache_dir='turnstile_cache',workers=4,rate=1.0,
+                   head=url_head,offline=False):
+    limiter = RateLimiter(rate)
+    pool = ThreadPool(max(1,workers))
+    try:
+        fetched = pool.map(lambda d: fetch_week(d,cache_dir,limiter,head,offline),dates)
+    finally:
+        pool.close()
+        pool.join()
+    return fetched
@@ -0,0 +1,235 @@
+import argparse
+import os
+import sys
+import pandas as pd
+import numpy as np
+import turnstile_cleaning
+import hourly_disaggregation
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import pipeline_io
+
+'''
+This script adds a newly published week of turnstile data to our hourly entries
+without re-running the cleaning and disaggregation for the whole history. It
+keeps a small state folder with:
+
+  last_readings.pkl  the last cumulative reading of every turnstile, which is
+                     used to compute the first entry_diff of the new week
+  totals.pkl         the number of rows and sum of entry_diff of every turnstile
+  scp_stats.pkl      the sum and count of entry_diff of every turnstile on each
+  unit_stats.pkl     day of the week and time (and the same for every unit),
+                     which are used to impute missing values
+  hour_stats.pkl     the stats of every turnstile and week_hour that the weekly
+                     curves are fit from
+  fit_sizes.pkl      the number of reports each turnstile had when its curve
+                     was last fit
+  profiles.pkl       the fitted weekly curves
+
+Each week's stats are added to the stored stats, and a turnstile's curve is only
+refit once its number of reports has grown by more than refresh_fraction since
+its last fit. The work for each update only depends on the size of the new week.
+'''
+
+# The columns that identify a single turnstile
+turnstile_cols = turnstile_cleaning.turnstile_cols
+# The names of the files in the state folder
+state_names = ['last_readings','totals','scp_stats','unit_stats','hour_stats',
+               'fit_sizes','profiles']
+# The columns of a stored reading
+reading_cols = ['c/a','unit','scp','station','linename','division','date','time',
+                'desc','entries','exits','date_time']
+
+
+# This function returns the sum and count of the original entry_diffs for a
+# single 4 hour period of every group of keys on each day of the week and time
+def profile_stats(turn1,keys):
+    observed = turn1[(turn1.entry_diff.notnull())&(turn1.num_periods==1)&(turn1.imputed==0)]
+    return observed.groupby(keys+['day_num','time']).entry_diff.agg(['sum','count'])
+
+
+# This function adds two stats tables together, keeping the groups that are
+# only in one of them
+def add_stats(old,new):
+    if old is None:
+        return new
+    return old.add(new,fill_value=0)
+
+
+# This function converts a stats table with a sum and count into a profile
+# table with a mean and count
+def stats_to_profiles(stats):
+    profiles = stats.copy()
+    profiles['mean'] = stats['sum']/stats['count']
+    return profiles
+
+
+# This function builds the state from a full run of turnstile_clean2015.py.
+# readings is the output of the parse stage (the raw cumulative readings) and
+# periods is the output of the multi_period stage (the cleaned 4 hour periods).
+def build_state(readings,periods,harmonics=10):
+    hour_stats = hourly_disaggregation.weekly_hour_stats(periods)
+    last_readings = readings[reading_cols].groupby(turnstile_cols).tail(1)
+    state = {'last_readings':last_readings.set_index(turnstile_cols),
+             'totals':periods.groupby(turnstile_cols).entry_diff.agg(['size','sum']),
+             'scp_stats':profile_stats(periods,turnstile_cols),
+             'unit_stats':profile_stats(periods,['c/a','unit']),
+             'hour_stats':hour_stats,
+             'fit_sizes':hour_stats['size'].groupby(level=turnstile_cols).sum(),
+             'profiles':hourly_disaggregation.fit_profiles_from_stats(hour_stats,harmonics)}
+    return state
+
+
+# This function saves the state to a folder
+def save_state(state,state_dir):
+    if not os.path.exists(state_dir):
+        os.makedirs(state_dir)
+    for name in state_names:
+        state[name].to_pickle(os.path.join(state_dir,name+'.pkl'))
+
+
+# This function loads the state from a folder
+def load_state(state_dir):
+    return dict((name,pd.read_pickle(os.path.join(state_dir,name+'.pkl')))
+                for name in state_names)
+
+
+# This function reads in a week of raw turnstile data (a csv in the format of
+# turnstile2015_stations.csv or a partition file from turnstile_scraper.py) and
+# keeps only the regular every 4-hour reports
+def read_week(path):
+    if path.endswith('.pkl'):
+        week = pd.read_pickle(path)
+    else:
+        week = pd.read_csv(path,dtype=dict((col,str) for col in turnstile_cols))
+        if 'Unnamed: 0' in week:
+            week.drop('Unnamed: 0',axis=1,inplace=True)
+    week['date_time'] = pd.to_datetime(week['date'].str.replace('/','-')+' '+week['time'],
+                                       errors='coerce')
+    week = week[(week.date_time.dt.minute == 0)&(week.date_time.dt.second == 0)]
+    return week.sort_values(by=turnstile_cols+['date_time'])
+
+
+# This function cleans a new week of readings into 4 hour periods, following
+# the same steps as turnstile_clean2015.py. Each turnstile's first entry_diff
+# is computed from its last stored reading, and missing values are imputed from
+# the stored profiles.
+def clean_week(week,state):
+    last = state['last_readings'].reset_index()
+    # Only keep readings after each turnstile's last stored reading
+    week = week.merge(last[turnstile_cols+['date_time']],on=turnstile_cols,how='left',
+                      suffixes=('','_last'))
+    week = week[week.date_time_last.isnull()|(week.date_time > week.date_time_last)]
+    week = week[reading_cols]
+    # Put each turnstile's last stored reading in front of its new readings so
+    # we can take the differences of the cumulative counts
+    seeds = last.set_index(turnstile_cols).index.isin(week.set_index(turnstile_cols).index)
+    turn1 = pd.concat([last[seeds],week],ignore_index=True)
+    is_seed = np.r_[np.ones(seeds.sum(),dtype=bool),np.zeros(len(week),dtype=bool)]
+    order = np.lexsort([turn1.date_time.values]+[turn1[col].values for col in reversed(turnstile_cols)])
+    turn1 = turn1.iloc[order].reset_index(drop=True)
+    is_seed = is_seed[order]
+    # A turnstile's first row has no previous reading to compare to
+    new_turnstile = (turn1[turnstile_cols] != turn1[turnstile_cols].shift(1)).any(axis=1).values
+    turn1['entry_diff'] = turn1['entries'].diff()
+    turn1.loc[new_turnstile,'entry_diff'] = np.nan
+    turn1['time_since_last'] = turn1['date_time'] - turn1['date_time'].shift(1)
+    # We will assume that a new turnstile last reported 4 hours before its first
+    # reading
+    turn1.loc[new_turnstile,'time_since_last'] = np.timedelta64(4,'h')
+    turn1['seed'] = is_seed
+    turnstile_cleaning.collapse_duplicate_reports(turn1)
+    turn1.reset_index(drop=True,inplace=True)
+    turnstile_cleaning.apply_error_rules(turn1,turnstile_cleaning.load_error_rules())
+    # Reset negative and abnormally large entry_diffs with the same rules as
+    # turnstile_clean2015.py
+    turnstile_cleaning.reset_negative_diffs(turn1)
+    turnstile_cleaning.reset_large_diffs(turn1)
+    turn1['day_num'] = turn1.date_time.dt.weekday
+    turn1['imputed'] = 0
+    # The seed rows are only there for their readings. Giving them NaN periods
+    # keeps them from being imputed or split, and drops them with the multiple
+    # period rows below.
+    turn1.loc[turn1.seed,'num_periods'] = np.nan
+    turn1.drop('seed',axis=1,inplace=True)
+    # Add this week's rows to the stored stats before imputing, so the 'only
+    # row for this turnstile' and 'every entry_diff is 0' rules see the whole
+    # history
+    new_rows = turn1[turn1.num_periods.notnull()]
+    totals = add_stats(state['totals'],new_rows.groupby(turnstile_cols).entry_diff.agg(['size','sum']))
+    scp_stats = add_stats(state['scp_stats'],profile_stats(new_rows,turnstile_cols))
+    unit_stats = add_stats(state['unit_stats'],profile_stats(new_rows,['c/a','unit']))
+    scp_profiles = stats_to_profiles(scp_stats)
+    turnstile_cleaning.impute_missing(turn1,scp_profiles,stats_to_profiles(unit_stats),totals)
+    turn1.reset_index(drop=True,inplace=True)
+    turnstile_cleaning.zero_long_small_diffs(turn1)
+    turn1 = turnstile_cleaning.drop_other_divisions(turn1)
+    turn1.loc[turn1.entry_diff.isnull()&turn1.num_periods.notnull(),'entry_diff'] = 0
+    # Split the rows for more than 1 period into 4 hour periods. The seed rows
+    # give the first new period of each turnstile its start time.
+    new_periods = turnstile_cleaning.explode_multi_period(turn1,scp_profiles)
+    turn1 = pd.concat([turn1,new_periods],ignore_index=True)
+    turn1 = turn1[turn1.num_periods <= 1]
+    turn1 = turn1.sort_values(by=turnstile_cols+['date_time'])
+    turn1.reset_index(drop=True,inplace=True)
+    turn1['hour'] = turn1.date_time.dt.hour
+    turn1['hours_since_last'] = turn1.time_since_last/np.timedelta64(1,'h')
+    turn1['week_hour'] = (turn1.day_num * 24) + turn1.hour
+    # Store each turnstile's latest reading for next week
+    latest = week.sort_values(by=turnstile_cols+['date_time'],kind='mergesort')
+    latest = latest.groupby(turnstile_cols).tail(1).set_index(turnstile_cols)
+    last_readings = state['last_readings']
+    last_readings = pd.concat([last_readings[~last_readings.index.isin(latest.index)],latest])
+    state = dict(state,last_readings=last_readings,totals=totals,scp_stats=scp_stats,
+                 unit_stats=unit_stats)
+    return turn1, state
+
+
+# This function adds a week's 4 hour periods to the stored hour stats and refits
+# the curves of the turnstiles whose number of reports has grown by more than
+# refresh_fraction since their last fit (and of any new turnstiles)
+def refresh_profiles(turn1,state,refresh_fraction=0.1,harmonics=10):
+    hour_stats = add_stats(state['hour_stats'],hourly_disaggregation.weekly_hour_stats(turn1))
+    sizes = hour_stats['size'].groupby(level=turnstile_cols).sum()
+    fit_sizes = state['fit_sizes'].reindex(sizes.index).fillna(0)
+    stale = sizes.index[(sizes - fit_sizes) > refresh_fraction*fit_sizes]
+    profiles = state['profiles']
+    if len(stale) > 0:
+        stale_stats = hour_stats[hour_stats.index.droplevel('week_hour').isin(stale)]
+        refit = hourly_disaggregation.fit_profiles_from_stats(stale_stats,harmonics)
+        profiles = pd.concat([profiles[~profiles.index.isin(refit.index)],refit]).sort_index()
+        fit_sizes = fit_sizes.copy()
+        fit_sizes[refit.index] = sizes[refit.index]
+    return dict(state,hour_stats=hour_stats,fit_sizes=fit_sizes,profiles=profiles)
+
+
+# This function adds one week of raw turnstile data to the hourly entries file
+# and updates the state
+def update_week(path,state_dir,output,refresh_fraction=0.1):
+    state = load_state(state_dir)
+    turn1, state = clean_week(read_week(path),state)
+    state = refresh_profiles(turn1,state,refresh_fraction)
+    turn_hourly = hourly_disaggregation.disaggregate_hourly(turn1,state['profiles'])
+    turn_hourly = turn_hourly.sort_values(by=turnstile_cols+['date_time'])
+    # Add the new hourly rows to our hourly entries as a new part named after
+    # the week (see pipeline_io.py), so the history is never read or written
+    # again. The state is only saved after the part, and if we crash in between
+    # the rerun starts from the old state and replaces the week's part instead
+    # of adding it twice. (A csv output is appended to and can't be replaced,
+    # so it should only be used when the update can be restarted by hand.)
+    week_name = os.path.splitext(os.path.basename(path))[0]
+    pipeline_io.append(turn_hourly,output,part=week_name)
+    save_state(state,state_dir)
+    return turn_hourly
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Add new weeks of turnstile data to the hourly entries')
+    parser.add_argument('weeks',nargs='+',help='weekly csv or partition files, in order')
+    parser.add_argument('--state-dir',default='incremental_state')
+    parser.add_argument('--output',default='2015_hourly_combined.parquet')
+    parser.add_argument('--refresh-fraction',type=float,default=0.1,
+                        help='refit a curve once its reports grow by this fraction')
+    args = parser.parse_args()
+    for path in args.weeks:
+        update_week(path,args.state_dir,args.output,args.refresh_fraction)
+        print('Added %s' % path)
@@ -1,11 +1,12 @@
 from datetime import date, timedelta
 from bs4 import BeautifulSoup
-import urllib
+import argparse
+import io
 import pandas as pd
-from time import sleep
+import numpy as np
+import os
+import turnstile_downloader
 
-# Define the head of the url we will be crawling through
-url_head = 'http://web.mta.info/developers/data/nyct/turnstile/turnstile_'
 # Define the column names for the DataFrames we will be working with
 cols = ['C/A','UNIT','SCP','DATE1','TIME1','DESC1','ENTRIES1','EXITS1','DATE2',
         'TIME2','DESC2','ENTRIES2','EXITS2','DATE3','TIME3','DESC3','ENTRIES3',
@@ -15,9 +16,6 @@ cols = ['C/A','UNIT','SCP','DATE1','TIME1','DESC1','ENTRIES1','EXITS1','DATE2',
         'ENTRIES8','EXITS8']
 entry_cols = ['c/a','unit','scp','station','linename','division','date','time','desc','entries','exits']
 
-# Create a blank DataFrame that we will append each week's data to
-all_combined = pd.DataFrame(columns=entry_cols)
-
 # This function is a generator that returns all Saturdays in a given year
 # as datetime objects
 def allsaturdays(year):
@@ -37,85 +35,146 @@ def allsaturdays(year):
         d += timedelta(days = 7)
 
 
-# This function takes in date parameters, crawls through the pages for
-# each Saturday in our date range, and returns a DataFrame of all turnstile data
-# for our date range
+# The csv format before 10/18/2014 only has the turnstile identifiers and 8
+# groups of date, time, desc, entries, and exits on each line
+old_entry_cols = ['c/a','unit','scp','date','time','desc','entries','exits']
+# The cumulative count columns, which we store as integers in each week's
+# partition file. Every other column is read in as a string.
+int_cols = ['entries','exits']
+
+
+# This function converts a DataFrame of the old (before 10/18/2014) format,
+# where each line contains 8 data points, into a long format where each line
+# contains a single data point. All 8 groups are split up at once by reshaping
+# the underlying array instead of joining and concatenating them one at a time.
+def reshape_week(df):
+    n = len(df)
+    # The first 3 columns contain identifying information that we want to
+    # include with each data point. Repeat it once for each of the 8 groups.
+    unit_info = np.tile(df.iloc[:,0:3].values,(8,1))
+    # Each data point group contains 5 columns. Reshape the 40 data columns so
+    # the first axis is the group number, then stack the groups on top of each
+    # other (all of group 1, then all of group 2, ...)
+    entries = df.iloc[:,3:43].values.reshape(n,8,5).transpose(1,0,2).reshape(n*8,5)
+    week = pd.DataFrame(np.hstack([unit_info,entries]),columns=old_entry_cols)
+    # Some lines in the csv don't have all 8 groups of data, so when split the
+    # blank ones will have NaNs. Drop these rows.
+    week.dropna(axis=0,how='any',inplace=True)
+    # Splitting into the 8 groups made our data out of order, so we sort by
+    # date and then time
+    week.sort_values(by=['date','time'],kind='mergesort',inplace=True)
+    week.reset_index(drop=True,inplace=True)
+    return week
+
+
+# This function gives a week's DataFrame the same columns and types as every
+# other week, so the partition files can be combined without any conversions
+def type_week(week):
+    # The old format doesn't have station, linename, or division columns, so
+    # these will be filled with NaNs
+    week = week.reindex(columns=entry_cols)
+    for col in int_cols:
+        week[col] = week[col].astype(np.int64)
+    return week
+
+
+# This function saves a week's DataFrame to its own partition file and returns
+# the path of the file
+def write_partition(week,d,out_dir):
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    path = os.path.join(out_dir,'turnstile_' + d.strftime('%y%m%d') + '.pkl')
+    week.to_pickle(path)
+    return path
+
+
+# This function combines the weekly partition files into a single csv. Only
+# one week is held in memory at a time, so memory use doesn't grow with the
+# number of weeks in our date range.
+def combine_partitions(paths,out_path):
+    # Keep a running row count so the saved index is unique across the weeks
+    offset = 0
+    for i, path in enumerate(paths):
+        week = pd.read_pickle(path)
+        week.index = np.arange(offset,offset+len(week))
+        offset += len(week)
+        # Write the header with the first week and append every week after it
+        if i == 0:
+            week.to_csv(out_path)
+        else:
+            week.to_csv(out_path,mode='a',header=False)
+
+
+# This function takes in date parameters, makes sure the page for each Saturday
+# in our date range is in our cache (downloading the ones that aren't), and
+# saves each week's turnstile data to its own partition file in out_dir. It
+# returns the list of partition files for our date range in chronological
+# order.
 # m/d_start is the month and date of the first Saturday in the range we want
 # m/d_end is the month and date of the last Saturday in the range we want
-def crawl_year(year,m_start,d_start,m_end,d_end):
-    # Create a blank DataFrame that we will append each week's data to
-    all_combined = pd.DataFrame(columns=entry_cols)
-    # Iterate through our list of Saturday's
-    for d in allsaturdays(year):
-        if d >= date(year,m_start,d_start) and d <= date(year,m_end,d_end):
-            sleep(5) # delays for 5 seconds (to prevent overloading the server)
-            # Generate the end of the url from the date
-            url_tail =  d.strftime('%y') + d.strftime('%m') + d.strftime('%d') + '.txt'
-            # Combine the url parts
-            url = url_head + url_tail
-            # Open the url and create a list of every line on the page
-            lines = urllib.urlopen(url).readlines()
-            # Write the data to a csv
-            with open("turnstileweek.csv", "w") as file_out:
-                for line in lines:
-                    file_out.write(line+"\n")
-            # The csv format was changed on 10/18/2014, we will parse the csv
-            # differently depending on this format
-            if d < date(2014,10,18):
-                # Create a DataFrame from our csv
-                df = pd.read_csv('turnstileweek.csv',header=None,names=cols)
-                # The csv is formatted such that each line contains 8 data points.
-                # We want to split this up so each line in our DataFrame contains one
-                # data point.
-                # The first 3 columns contain identifying information that we want to
-                # include with each data point. We select those columns:
-                unit_info = df.iloc[:,0:3]
-                # Create an empty DataFrame that we will use to convert our original
-                # DataFrame from a wide to long format.
-                week_combined = pd.DataFrame(columns=entry_cols)
-                # Split up the remaining columns into their 8 data point groups
-                for i in range(8):
-                    # Each data point group contains 5 columns
-                    x = 3 + (5*i)
-                    y = 8 + (5*i)
-                    # Select the columns
-                    entry = df.iloc[:,x:y]
-                    # Join this data point with the identifying info in unit_info
-                    entry = unit_info.join(entry)
-                    # Set our column names so we can concat our DataFrames
-                    entry.columns = entry_cols
-                    week_combined = pd.concat([week_combined,entry],axis=0)
-                    # Some lines in the csv don't have all 8 groups of data, so when
-                    # split the blank ones will have NaNs. Drop these rows.
-                    week_combined.dropna(axis=0,how='any',inplace=True)
-                # Splitting into the 8 groups made our data out of order, so we sort
-                # by date and then time
-                week_combined.sort_values(by=['date','time'],inplace=True)
-                # Concat this weeks DataFrame to our master DataFrame
-                all_combined = pd.concat([all_combined,week_combined],axis=0)
-            else:
-                # Create a DataFrame from our csv
-                df = pd.read_csv('turnstileweek.csv',header=0)
-                # After 10/18/2014 they fixed the csv to only have one data
-                # point per line, so we don't need to split each line into 8
-                # groups anymore
-                # There are 3 additional columns in this new format which we
-                # don't need, so we drop those
-                # df.drop(['STATION','LINENAME','DIVISION'],axis=1,inplace=True)
-                # Rename the columns (make them lowercase) so they match the
-                # column names of our pre 10/18/14 data
-                df.columns = entry_cols
-                # Concat this weeks DataFrame to our master DataFrame
-                all_combined = pd.concat([all_combined,df],axis=0)
-            # Print the date so we can keep track of the script's progress
-            print d
-    # Return the DataFrame containing all the weeks' data for our specified
-    # date range
-    return all_combined
-# Crawl through the pages in the date ranges we need data for
-# data2014 = crawl_year(2014,3,29,10,4)
-data2015 = crawl_year(2015,1,3,7,4)
-data2015
-# Save our DataFrames to csv
-# data2014.to_csv('turnstile2014.csv')
-data2015.to_csv('turnstile2015_stations.csv',ignore_index=True)
+# With offline=True nothing is downloaded and every week must be in the cache.
+def crawl_year(year,m_start,d_start,m_end,d_end,out_dir='turnstile_weeks',
+               cache_dir='turnstile_cache',workers=4,rate=1.0,
+               head=turnstile_downloader.url_head,offline=False):
+    # Get the list of Saturdays in our date range
+    dates = [d for d in allsaturdays(year)
+             if d >= date(year,m_start,d_start) and d <= date(year,m_end,d_end)]
+    # Download every week that isn't cached yet
+    turnstile_downloader.download_weeks(dates,cache_dir=cache_dir,
+                                        workers=workers,rate=rate,head=head,
+                                        offline=offline)
+    # Create a blank list that we will add each week's partition file to
+    paths = []
+    for d in dates:
+        # Read this week's file straight from the cache
+        raw = io.BytesIO(turnstile_downloader.read_cached(d,cache_dir))
+        # The csv format was changed on 10/18/2014, we will parse the csv
+        # differently depending on this format
+        if d < date(2014,10,18):
+            # Create a DataFrame from our csv
+            df = pd.read_csv(raw,header=None,names=cols,
+                             dtype={col:str for col in cols if col[:-1] not in ['ENTRIES','EXITS']})
+            # The csv is formatted such that each line contains 8 data
+            # points. We want to split this up so each line in our
+            # DataFrame contains one data point.
+            week = reshape_week(df)
+        else:
+            # Create a DataFrame from our csv
+            week = pd.read_csv(raw,header=0,dtype=str)
+            # After 10/18/2014 they fixed the csv to only have one data
+            # point per line, so we don't need to split each line into 8
+            # groups anymore
+            # Rename the columns (make them lowercase) so they match the
+            # column names of our pre 10/18/14 data
+            week.columns = entry_cols
+        # Save this week to its own partition file
+        paths.append(write_partition(type_week(week),d,out_dir))
+        # Print the date so we can keep track of the script's progress
+        print d
+    # Return the partition files for our specified date range
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Crawl the MTA turnstile data')
+    parser.add_argument('--offline',action='store_true',
+                        help='rebuild the csv from the cache without downloading')
+    parser.add_argument('--workers',type=int,default=4,
+                        help='number of weeks to download at once')
+    parser.add_argument('--rate',type=float,default=1.0,
+                        help='maximum number of requests per second')
+    parser.add_argument('--cache-dir',default='turnstile_cache')
+    parser.add_argument('--url-head',default=turnstile_downloader.url_head,
+                        help='url prefix of the weekly files (i.e. a local test server)')
+    args = parser.parse_args()
+    # Crawl through the pages in the date ranges we need data for
+    # data2014 = crawl_year(2014,3,29,10,4,out_dir='turnstile_weeks_2014',
+    #                       cache_dir=args.cache_dir,workers=args.workers,
+    #                       rate=args.rate,head=args.url_head,
+    #                       offline=args.offline)
+    data2015 = crawl_year(2015,1,3,7,4,cache_dir=args.cache_dir,
+                          workers=args.workers,rate=args.rate,
+                          head=args.url_head,offline=args.offline)
+    # Combine the weeks and save to csv
+    # combine_partitions(data2014,'turnstile2014.csv')
+    combine_partitions(data2015,'turnstile2015_stations.csv')
@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import matplotlib as plt
+import zone_crosswalk
 %matplotlib inline
 
 #Read in the dataset of Uber rides from January 2015 to June 2015 and checkout the first 5 entries
@@ -28,3 +29,18 @@ data.hist(layout=(1,2))
 
 #export to a csv for graphing in tableau or merging with other data sets
 data.to_csv('2015final.csv')
+
+#The 2014 data is by neighborhood (NTA) instead of taxi zone. Count the rides in each zone for every hour
+data['date_hour'] = data['Pickup_date'].dt.floor('h')
+zone_hours = data.groupby(['date_hour','LocationID']).size().unstack(fill_value=0)
+#Load the area-weighted crosswalk between the taxi zones and the NTAs (it is built from the zone shapefile the first time)
+weights, zone_ids, nta_codes = zone_crosswalk.get_crosswalk('/Users/Starshine/DSI/Capstone/taxi_zones/taxi_zones.shp')
+#Split each zone's rides between the NTAs it overlaps with one sparse matrix multiply
+nta_hours = zone_crosswalk.zones_to_ntas(zone_hours,weights,zone_ids,nta_codes)
+#Reshape to one row per neighborhood and hour, in the same format as the 2014 rides
+nta_hours = nta_hours.stack().reset_index()
+nta_hours.columns = ['date_hour','nta','rides']
+nta_hours['date_hour'] = nta_hours['date_hour'].dt.strftime('%Y-%m-%d %H:%M:%S')
+nta_hours.head()
+#export the hourly rides for each neighborhood so they can be used with the 2014 models
+nta_hours[['nta','date_hour','rides']].to_csv('2015_nta_hourly.csv',index=False)
@@ -1,54 +1,44 @@
 import pandas as pd
 import numpy as np
-import calendar
 import fill_hours
 
-def add_missing_hours(df):
+def add_missing_hours(df,lat=40.728686,lon=-73.84227,base='B07777',
+                      lat_col='Lat',lon_col='Lon',base_col='Base',marker=1,
+                      marker_col=None):
     '''
-    This function creates a row for any hour (of a month) that doesn't have a
-    ride. For our Tableau visualizations we need at least one entry for each
-    hour to ensure the time spacing is consistent. The new rows will have a
+    This function creates a row for any hour (of the months in df) that doesn't
+    have a ride. For our Tableau visualizations we need at least one entry for
+    each hour to ensure the time spacing is consistent. The new rows will have a
     latitude and longitude that is far enough away from the area we are looking
-    at that it won't appear on our visualization.
+    at that it won't appear on our visualization. The new rows are at 30 minutes
+    past the hour, and get lat, lon, and base in the lat_col, lon_col, and
+    base_col columns. marker is put in marker_col (by default the fifth column
+    of df, like the fake rows have always had) so our Tableau workbooks can
+    tell the new rows apart. Any other columns are left empty. df can have more
+    than one month of data.
     '''
     # Convert our Date/Time column to datetime
     df['Date/Time'] = pd.to_datetime(df['Date/Time'])
-    # Create new columns for the row's day of the month and hour of the day
-    df['day'] = df['Date/Time'].apply(lambda t: t.day)
-    df['hour'] = df['Date/Time'].apply(lambda t: t.hour)
-    # Get the month and year of the data we are looking at.
-    # We can assume the DataFrame that is passed to this function only contains
-    # data for one month, so we can pull the month and year from any row.
-    month = df.ix[0,'Date/Time'].month
-    year = df.ix[0,'Date/Time'].year
-    # Create a Calendar object
-    cal = calendar.Calendar()
-    # Iterate through the days of this month
-    for day in cal.itermonthdays(year,month):
-        # itermonthdays() returns 0s at the start and end, we want to ignore
-        # these values.
-        if day != 0:
-            # Iterate through each hour of the day
-            for hour in range(24):
-                # Get only the rows that are for this day and hour combination
-                day_hour = df[(df.day==day)&(df.hour==hour)]
-                # Check to see if there are any rows matching this day and hour
-                if len(day_hour) < 1:
-                    # If not, we need to create a fake row for this day and hour
-                    # Build a string that can be parsed by np.datetime64()
-                    date_string = '-'.join([str(year),str(month).zfill(2),str(day).zfill(2)])
-                    hour_string = ':'.join([str(hour).zfill(2),'30'])
-                    dtime_string = 'T'.join([date_string,hour_string])
-                    # Convert our string to datetime
-                    dtime = np.datetime64(dtime_string)
-                    # Add a new row to the DataFrame. The latitude and longitude
-                    # values are far values we picked that are far enough away
-                    # from the areas we are going to visualize that they won't
-                    # appear on the map. The only column we are updating is
-                    # 'Date/Time'.
-                    df.loc[len(df)]=['B07777',dtime,'40.728686','-73.84227','1',day,hour]
-    # Drop the day and hour columns since they are no longer needed
-    df.drop(['day','hour'],axis=1,inplace=True)
+    # Get the hour each ride is in
+    hours = df['Date/Time'].dt.floor('h')
+    # Get every hour of every month in our data
+    months = hours.dt.to_period('M').unique()
+    all_hours = pd.DatetimeIndex(np.concatenate(
+        [pd.date_range(m.start_time,m.end_time,freq='h').values for m in months]))
+    # The hours that don't have a ride
+    missing = all_hours.difference(pd.DatetimeIndex(hours.unique()))
+    # Create all of the new rows at once. The latitude and longitude values are
+    # far values we picked that are far enough away from the areas we are going
+    # to visualize that they won't appear on the map.
+    new_rows = pd.DataFrame(index=np.arange(len(missing)),columns=df.columns)
+    new_rows['Date/Time'] = missing + pd.Timedelta('30 minutes')
+    new_rows[lat_col] = lat
+    new_rows[lon_col] = lon
+    new_rows[base_col] = base
+    if marker_col is None and len(df.columns) > 4:
+        marker_col = df.columns[4]
+    if marker_col is not None:
+        new_rows[marker_col] = marker
     # Return our DataFrame which now contains at least one row for each hour of
     # each day
-    return df
+    return pd.concat([df,new_rows],ignore_index=True)
@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import numpy as np
+
+'''
+This module saves the NTA found for each latitude/longitude point in a SQLite
+database, so a point only has to be located once no matter how many runs,
+months, or data sets it shows up in. Points are keyed by their latitude and
+longitude rounded to 6 decimal places (about 10cm), packed into one integer:
+
+  key = (lat*1e6 + 9e7)*4e8 + (lon*1e6 + 1.8e8)
+
+Points that aren't in any NTA are saved too (with a NULL code) so they aren't
+located again. The database remembers the hash of the shapes its codes came
+from, and is emptied if it is opened with different shapes.
+'''
+
+# The default location of the cache, shared by every script in the project
+default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),'geocode_cache.sqlite')
+# The number of keys looked up with each query
+lookup_size = 900
+# The number of seconds to wait for another connection's write to finish
+timeout = 60
+
+
+# This function returns the integer key of each latitude/longitude point
+def coordinate_keys(lats,lons):
+    lat_q = np.round(np.asarray(lats,dtype=float)*1e6).astype(np.int64)
+    lon_q = np.round(np.asarray(lons,dtype=float)*1e6).astype(np.int64)
+    return (lat_q + 90000000)*400000000 + (lon_q + 180000000)
+
+
+# This class is a connection to the cache. shapes_hash identifies the shapes
+# the codes were found with (i.e. NTALocator.shapes_hash). With read_only=True
+# the database is never changed, so many processes can read it at once.
+class GeocodeCache(object):
+    def __init__(self,path=default_path,shapes_hash=None,read_only=False):
+        self.path = path
+        self.read_only = read_only
+        if read_only:
+            self.conn = sqlite3.connect('file:%s?mode=ro' % path,uri=True,timeout=timeout)
+        else:
+            self.conn = sqlite3.connect(path,timeout=timeout)
+            # Write ahead logging lets readers keep reading while we write
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS geocodes (key INTEGER PRIMARY KEY, nta TEXT)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+            self.conn.commit()
+        if shapes_hash is not None:
+            self._check_shapes(shapes_hash)
+
+    # This function empties the cache if its codes came from different shapes
+    def _check_shapes(self,shapes_hash):
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'shapes_hash'").fetchone()
+        if row is not None and row[0] == shapes_hash:
+            return
+        if self.read_only:
+            raise ValueError('The geocode cache at %s was built from different shapes' % self.path)
+        self.conn.execute('DELETE FROM geocodes')
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('shapes_hash', ?)",(shapes_hash,))
+        self.conn.commit()
+
+    # This function looks up many keys at once. It returns a boolean array of
+    # which keys were found and an array of their codes (None for keys that
+    # weren't found or aren't in any NTA).
+    def get(self,keys):
+        keys = np.asarray(keys,dtype=np.int64)
+        found = np.zeros(len(keys),dtype=bool)
+        codes = np.empty(len(keys),dtype=object)
+        # Look up the exact keys, a batch of them per query, so only the rows
+        # for those keys are read from the primary key no matter how big the
+        # cache is. Batches are smaller than SQLite's limit of 999 parameters.
+        # The rows are matched to the keys with a binary search.
+        unique_keys = np.unique(keys)
+        rows = []
+        for start in range(0,len(unique_keys),lookup_size):
+            batch = unique_keys[start:start+lookup_size].tolist()
+            rows += self.conn.execute('SELECT key, nta FROM geocodes WHERE key IN (%s)' %
+                                      ','.join('?'*len(batch)),batch).fetchall()
+        if len(rows) > 0:
+            row_keys = np.fromiter((row[0] for row in rows),dtype=np.int64,count=len(rows))
+            row_codes = np.empty(len(rows),dtype=object)
+            row_codes[:] = [row[1] for row in rows]
+            order = np.argsort(row_keys)
+            row_keys = row_keys[order]
+            row_codes = row_codes[order]
+            match = np.searchsorted(row_keys,keys)
+            match[match == len(rows)] = 0
+            found = row_keys[match] == keys
+            codes[found] = row_codes[match[found]]
+        return found, codes
+
+    # This function saves the codes of many keys at once
+    def put(self,keys,codes):
+        rows = zip(np.asarray(keys,dtype=np.int64).tolist(),list(codes))
+        self.conn.executemany('INSERT OR REPLACE INTO geocodes VALUES (?, ?)',rows)
+        self.conn.commit()
+
+    # This function returns the NTA code of each point. Points in the cache are
+    # looked up, and the rest are found with the locator and added to the
+    # cache (unless it is read only).
+    def locate(self,locator,lons,lats):
+        keys = coordinate_keys(lats,lons)
+        unique_keys, first, inverse = np.unique(keys,return_index=True,return_inverse=True)
+        found, codes = self.get(unique_keys)
+        missing = ~found
+        if missing.any():
+            points = first[missing]
+            codes[missing] = locator.locate(np.asarray(lons,dtype=float)[points],
+                                            np.asarray(lats,dtype=float)[points])
+            if not self.read_only:
+                self.put(unique_keys[missing],codes[missing])
+        return codes[inverse.ravel()]
+
+    def close(self):
+        self.conn.close()
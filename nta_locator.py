@@ -0,0 +1,338 @@
+import hashlib
+import json
+import os
+import numpy as np
+import shapely
+import shapely.geometry
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+
+'''
+This module finds the NTA (Neighborhood Tabulation Area) that each
+longitude/latitude point is in. The shapes are loaded from
+neighborhood_shapes.json once and put in an R-tree, so each point is only
+tested against the few shapes whose bounding boxes contain it instead of every
+shape. It is shared by the scripts that map Uber rides and subway stations to
+neighborhoods.
+
+For millions of points, the locator can also use a grid of small cells over
+the shapes' bounding box. Each cell stores the shape it is entirely inside
+(inside_none if it is outside every shape, or on_boundary if a shape's boundary
+crosses it), so most points are found by looking up their cell and only points
+in boundary cells are tested against the shapes. The grid is saved in grid_dir
+under the sha1 of the GeoJSON file, so it is rebuilt whenever the file changes.
+
+Parsing the GeoJSON takes much longer than anything else when a locator starts
+up, which adds up when every worker process builds its own locator. build_bundle
+compiles the shapes (and their grid) into a folder of .npy files:
+
+  wkb.npy      every shape's WKB, one after another
+  offsets.npy  where each shape's WKB starts and ends in wkb.npy
+  codes.npy    each shape's id code
+  grid.npy     the grid, with its origin and cell size in meta.json
+  meta.json    the sha1 of the file the shapes came from
+
+which from_bundle memory-maps and turns back into shapes in a few milliseconds.
+The shapes' bounding boxes aren't saved: the R-tree has to be rebuilt from the
+shapes anyway (shapely can't save it) and computes them itself, and the grid's
+extent follows from its origin, cell size, and shape. The Zillow neighborhood
+shapefile can be compiled into the same bundle as a second layer. Each layer's
+meta.json has the sha1 of its own source file, so load_bundle rebuilds the
+bundle when either file changes.
+'''
+
+# The default location of our GeoJSON file of NTA shapes
+shapes_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'Subway_Data','neighborhood_shapes.json')
+
+
+# The default location of the binary bundle of shapes
+bundle_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),'nta_bundle')
+# The default location of the Zillow neighborhood shapefile
+zillow_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'ZillowNeighborhoods-NY','ZillowNeighborhoods-NY.shp')
+
+
+# The values stored in grid cells that aren't entirely inside a single shape
+on_boundary = -1
+inside_none = -2
+
+
+# This function returns the sha1 hash of a file's contents
+def _file_hash(path):
+    sha = hashlib.sha1()
+    with open(path,'rb') as f:
+        for block in iter(lambda: f.read(1 << 20),b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+# This function reads the GeoJSON file and returns a list of the shapes and a
+# list of their NTA id codes, in the same order as the file
+def load_shapes(path=shapes_path):
+    with open(path,'r') as f:
+        js = json.load(f)
+    polygons = []
+    codes = []
+    for feature in js['features']:
+        polygons.append(shapely.geometry.shape(feature['geometry']))
+        codes.append(feature['properties']['NTACode'])
+    return polygons, codes
+
+
+# This function reads the Zillow neighborhood shapefile and returns a list of
+# the shapes and a list of their Zillow region ids, in the same order as the
+# file. It needs fiona.
+def load_zillow_shapes(path=zillow_path):
+    import fiona
+    polygons = []
+    codes = []
+    with fiona.open(path) as shapefile:
+        for record in shapefile:
+            polygons.append(shapely.geometry.shape(record['geometry']))
+            codes.append('%d' % float(record['properties']['REGIONID']))
+    return polygons, codes
+
+
+# This class finds the NTA of many points at once. If a point is in more than
+# one shape (the shapes overlap slightly along some borders), it gets the first
+# shape in the file that contains it, just like looping through the shapes in
+# order. Points that aren't in any shape get None.
+class NTALocator(object):
+    def __init__(self,polygons,codes,shapes_hash=None):
+        # The sha1 of the file the shapes came from, which identifies the
+        # shapes in caches of our results
+        self.shapes_hash = shapes_hash
+        self.grid = None
+        # Fill the array one shape at a time so numpy doesn't try to turn the
+        # shapes themselves into arrays
+        self.polygons = np.empty(len(polygons),dtype=object)
+        self.polygons[:] = list(polygons)
+        self.codes = np.array(codes,dtype=object)
+        self.tree = STRtree(list(polygons))
+        # Shapely 2 can test every point at once. Older versions need a
+        # prepared copy of each shape to test one point at a time.
+        self.vectorized = hasattr(shapely,'contains_xy')
+        if self.vectorized:
+            shapely.prepare(self.polygons)
+        else:
+            self.prepared = [prep(polygon) for polygon in self.polygons]
+            self.positions = dict((id(polygon),i) for i, polygon in enumerate(polygons))
+
+    # This function builds a locator from a GeoJSON file. If grid_dir is given
+    # the locator also uses a grid with cells cell_size degrees wide, which is
+    # loaded from grid_dir if it was already built for this file. Building the
+    # grid needs shapely 2.
+    @classmethod
+    def from_json(cls,path=shapes_path,grid_dir=None,cell_size=0.0005):
+        polygons, codes = load_shapes(path)
+        locator = cls(polygons,codes,_file_hash(path))
+        if grid_dir is not None and locator.vectorized:
+            grid_path = os.path.join(grid_dir,'nta_grid_%s_%g.npz' % (locator.shapes_hash[:16],cell_size))
+            if os.path.exists(grid_path):
+                locator.load_grid(grid_path)
+            else:
+                locator.build_grid(cell_size)
+                locator.save_grid(grid_path)
+        return locator
+
+    # This function builds a locator from one layer of a bundle saved by
+    # save_bundle(). The arrays are memory-mapped, so the grid is shared
+    # between every process that loads the same bundle.
+    @classmethod
+    def from_bundle(cls,bundle_dir=bundle_path,layer='nta'):
+        folder = os.path.join(bundle_dir,layer)
+        with open(os.path.join(folder,'meta.json'),'r') as f:
+            meta = json.load(f)
+        wkb = np.load(os.path.join(folder,'wkb.npy'),mmap_mode='r')
+        offsets = np.load(os.path.join(folder,'offsets.npy'))
+        blobs = [wkb[start:stop].tobytes() for start, stop in zip(offsets[:-1],offsets[1:])]
+        polygons = shapely.from_wkb(blobs)
+        codes = np.load(os.path.join(folder,'codes.npy'))
+        locator = cls(polygons,codes.astype(object),meta['shapes_hash'])
+        if 'cell_size' in meta:
+            locator.grid = np.load(os.path.join(folder,'grid.npy'),mmap_mode='r')
+            locator.grid_origin = np.array(meta['grid_origin'])
+            locator.cell_size = meta['cell_size']
+        return locator
+
+    # This function saves the shapes, codes, and grid to a layer of a bundle
+    def save_bundle(self,bundle_dir=bundle_path,layer='nta'):
+        folder = os.path.join(bundle_dir,layer)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        blobs = shapely.to_wkb(self.polygons)
+        sizes = np.array([len(blob) for blob in blobs],dtype=np.int64)
+        offsets = np.r_[0,np.cumsum(sizes)]
+        meta = {'shapes_hash':self.shapes_hash}
+        np.save(os.path.join(folder,'wkb.npy'),np.frombuffer(b''.join(blobs),dtype=np.uint8))
+        np.save(os.path.join(folder,'offsets.npy'),offsets)
+        np.save(os.path.join(folder,'codes.npy'),np.array(self.codes.tolist(),dtype=str))
+        if self.grid is not None:
+            np.save(os.path.join(folder,'grid.npy'),np.asarray(self.grid))
+            meta['grid_origin'] = [float(x) for x in self.grid_origin]
+            meta['cell_size'] = float(self.cell_size)
+        # meta.json is written last, so a bundle that was only partly saved
+        # has no meta.json (or an old one with a different hash) and is rebuilt
+        with open(os.path.join(folder,'meta.json'),'w') as f:
+            json.dump(meta,f)
+
+    # This function builds the grid over bounds (min_x, min_y, max_x, max_y),
+    # which defaults to the bounding box of the shapes. A cell is on a boundary
+    # if any shape's boundary touches it. Every other cell is entirely inside
+    # the same shapes as its center, so it gets the shape of its center point.
+    def build_grid(self,cell_size=0.0005,bounds=None):
+        self.grid = None
+        if bounds is None:
+            bounds = shapely.total_bounds(self.polygons)
+        min_x, min_y, max_x, max_y = bounds
+        num_x = int(np.ceil((max_x - min_x)/cell_size))
+        num_y = int(np.ceil((max_y - min_y)/cell_size))
+        xs, ys = np.meshgrid(min_x + np.arange(num_x)*cell_size,
+                             min_y + np.arange(num_y)*cell_size)
+        xs = xs.ravel()
+        ys = ys.ravel()
+        grid = self.locate_index(xs + cell_size/2,ys + cell_size/2)
+        grid[grid < 0] = inside_none
+        cells = shapely.box(xs,ys,xs + cell_size,ys + cell_size)
+        boundaries = STRtree(shapely.boundary(self.polygons))
+        crossed, _ = boundaries.query(cells,predicate='intersects')
+        grid[crossed] = on_boundary
+        self.grid = grid.reshape(num_y,num_x).astype(np.int32)
+        self.grid_origin = np.array([min_x,min_y])
+        self.cell_size = cell_size
+
+    # This function saves the grid to an .npz file
+    def save_grid(self,path):
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        # Save to a temporary file first so a crash while saving never leaves a
+        # partial file that looks valid
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path,grid=self.grid,origin=self.grid_origin,cell_size=self.cell_size)
+        os.rename(tmp_path,path)
+
+    # This function loads a grid saved by save_grid()
+    def load_grid(self,path):
+        saved = np.load(path)
+        self.grid = saved['grid']
+        self.grid_origin = saved['origin']
+        self.cell_size = float(saved['cell_size'])
+
+    # This function returns the position (in the file) of the shape that each
+    # point is in, or -1 if it isn't in any shape. Points in grid cells that are
+    # entirely inside one shape (or no shape) are found from the grid, and the
+    # rest are tested against the shapes.
+    def locate_index(self,lons,lats):
+        if self.grid is None:
+            return self._locate_exact(lons,lats)
+        lons = np.asarray(lons,dtype=float)
+        lats = np.asarray(lats,dtype=float)
+        num_y, num_x = self.grid.shape
+        with np.errstate(invalid='ignore'):
+            col = np.floor((lons - self.grid_origin[0])/self.cell_size)
+            row = np.floor((lats - self.grid_origin[1])/self.cell_size)
+            in_grid = (col >= 0) & (col < num_x) & (row >= 0) & (row < num_y)
+        cells = np.full(len(lons),on_boundary,dtype=np.int64)
+        cells[in_grid] = self.grid[row[in_grid].astype(np.int64),col[in_grid].astype(np.int64)]
+        result = np.where(cells == inside_none,-1,cells)
+        # Points on a boundary or outside the grid need an exact test
+        exact = cells == on_boundary
+        result[exact] = self._locate_exact(lons[exact],lats[exact])
+        return result
+
+    # This function tests every point against the shapes
+    def _locate_exact(self,lons,lats):
+        lons = np.asarray(lons,dtype=float)
+        lats = np.asarray(lats,dtype=float)
+        result = np.full(len(lons),-1,dtype=np.int64)
+        if len(lons) == 0:
+            return result
+        if self.vectorized:
+            # Get every (point, shape) pair where the point is inside the
+            # shape's bounding box, and then test all of the pairs at once
+            points, shapes = self.tree.query(shapely.points(lons,lats))
+            inside = shapely.contains_xy(self.polygons[shapes],lons[points],lats[points])
+            points = points[inside]
+            shapes = shapes[inside]
+            # Keep the first shape in the file for each point
+            order = np.lexsort([shapes,points])
+            points, first = np.unique(points[order],return_index=True)
+            result[points] = shapes[order][first]
+            return result
+        for i in range(len(lons)):
+            point = shapely.geometry.Point(lons[i],lats[i])
+            positions = sorted(self.positions[id(polygon)] for polygon in self.tree.query(point))
+            for position in positions:
+                if self.prepared[position].contains(point):
+                    result[i] = position
+                    break
+        return result
+
+    # This function returns the NTA id code of each point, or None if the point
+    # isn't in any shape
+    def locate(self,lons,lats):
+        index = self.locate_index(lons,lats)
+        codes = np.empty(len(index),dtype=object)
+        codes[index >= 0] = self.codes[index[index >= 0]]
+        return codes
+
+
+# This function compiles the NTA shapes (and optionally the Zillow shapes) and
+# their grids into a bundle. The Zillow shapes cover all of New York state, so
+# both grids only cover the NTAs' bounding box (New York City).
+def build_bundle(bundle_dir=bundle_path,path=shapes_path,zillow=None,cell_size=0.0005):
+    locator = NTALocator.from_json(path)
+    nyc_bounds = shapely.total_bounds(locator.polygons)
+    locator.build_grid(cell_size)
+    locator.save_bundle(bundle_dir,'nta')
+    if zillow is not None:
+        polygons, codes = load_zillow_shapes(zillow)
+        locator = NTALocator(polygons,codes,_file_hash(zillow))
+        locator.build_grid(cell_size,nyc_bounds)
+        locator.save_bundle(bundle_dir,'zillow')
+
+
+# This function returns the meta.json of a layer of the bundle, or None if the
+# layer hasn't been saved
+def _bundle_meta(bundle_dir,layer):
+    meta_path = os.path.join(bundle_dir,layer,'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path,'r') as f:
+        return json.load(f)
+
+
+# This function returns True if a layer of the bundle was built from the file
+# at path with grid cells cell_size degrees wide
+def _is_current(bundle_dir,layer,path,cell_size):
+    meta = _bundle_meta(bundle_dir,layer)
+    return (meta is not None and meta['shapes_hash'] == _file_hash(path) and
+            meta.get('cell_size') == cell_size)
+
+
+# This function returns a locator for a layer ('nta' or 'zillow') of the
+# bundle, first rebuilding the bundle if it is missing or any of its layers was
+# built from a different file (or cell size). The Zillow layer is only checked
+# and built if zillow (the path of the shapefile) is given.
+def load_bundle(bundle_dir=bundle_path,path=shapes_path,cell_size=0.0005,zillow=None,
+                layer='nta'):
+    current = _is_current(bundle_dir,'nta',path,cell_size)
+    if zillow is not None:
+        current = current and _is_current(bundle_dir,'zillow',zillow,cell_size)
+    if not current:
+        build_bundle(bundle_dir,path,zillow,cell_size)
+    return NTALocator.from_bundle(bundle_dir,layer)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Compile the neighborhood shapes into a binary bundle')
+    parser.add_argument('--bundle-dir',default=bundle_path)
+    parser.add_argument('--shapes',default=shapes_path,help='GeoJSON file of NTA shapes')
+    parser.add_argument('--zillow',nargs='?',const=zillow_path,default=None,
+                        help='also compile the Zillow neighborhood shapefile')
+    parser.add_argument('--cell-size',type=float,default=0.0005)
+    args = parser.parse_args()
+    build_bundle(args.bundle_dir,args.shapes,args.zillow,args.cell_size)
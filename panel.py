@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import time_keys
+
+'''
+This module turns grouped counts (i.e. the number of rides in each neighborhood
+and hour, which only has rows for the hours that had a ride) into a complete
+panel with a row for every neighborhood and every hour, filling in zeros for the
+missing rows. The panel is built by reindexing the counts against the product
+of the neighborhoods and hours, so it works the same way for the 2014 and 2015
+rides and for the turnstile entries.
+'''
+
+
+# This function returns the hour keys of every hour in the given months of a
+# year
+def month_hour_keys(year,months):
+    keys = []
+    for month in sorted(months):
+        start = pd.Timestamp(year=year,month=month,day=1)
+        end = start + pd.DateOffset(months=1)
+        keys.append(time_keys.hour_keys(pd.date_range(start,end,freq='h',inclusive='left')))
+    return np.concatenate(keys) if keys else np.array([],dtype=np.int64)
+
+
+# This function returns a panel with one row for every entity (i.e. nta) and
+# hour key in counts, in that order. Rows that aren't in counts get fill_value
+# for every other column. entities and hours default to every entity and every
+# hour between the first and last hour in counts.
+def build_panel(counts,entity_col,hour_col='hour_key',entities=None,hours=None,
+                fill_value=0):
+    if entities is None:
+        entities = np.sort(counts[entity_col].dropna().unique())
+    if hours is None:
+        hours = np.arange(counts[hour_col].min(),counts[hour_col].max() + 1)
+    index = pd.MultiIndex.from_product([entities,hours],names=[entity_col,hour_col])
+    panel = counts.set_index([entity_col,hour_col]).reindex(index,fill_value=fill_value)
+    return panel.reset_index()
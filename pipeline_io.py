@@ -0,0 +1,301 @@
+import fnmatch
+import glob
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import time_keys
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+'''
+This module saves and loads the data sets our scripts hand to each other (i.e.
+2014_hourly, the mapped Uber rides, 2014_combined_final). They are saved as
+compressed Parquet (or Feather) files with an explicit type for each column in
+schemas, so the next script gets datetimes, timedeltas, and string ids back
+without parsing text or calling pd.to_datetime again. The format is picked from
+the file's extension:
+
+  .parquet  compressed columnar file, saved in row groups. Reading can skip
+            columns that aren't needed and row groups that don't match the
+            filters.
+  .feather  columnar file that loads faster than Parquet, but is always read
+            in full
+  .csv      text, for Tableau and for data sets saved before this module. The
+            schema's types are applied after parsing.
+
+If the file a script asks for doesn't exist, the same data set with one of the
+other extensions is loaded instead, so a script can read data that an older
+step still saves as a csv.
+
+Parquet and Feather files can't be appended to, so append turns the data set
+into a folder with the same name (i.e. 2015_hourly_combined.parquet/) holding
+one part file per append. load reads every part of a folder in order, so the
+scripts don't need to know whether a data set is a single file or a folder.
+'''
+
+# The type of the columns of each data set, by its file name without the
+# extension (patterns like uber-* match every month's file). Columns that
+# aren't listed keep the type pandas gives them. A datetime column read from
+# text can give its format after a colon (i.e. 'datetime:%m/%d/%Y %H:%M:%S').
+# Timestamps that don't parse raise an error instead of becoming NaT.
+turnstile_types = {'c/a':'str','unit':'str','scp':'str','station':'str',
+                   'linename':'str','division':'str'}
+hourly_types = dict(turnstile_types,date_time='datetime',entry_diff='float64',
+                    hour_num='int64')
+schemas = {'turnstile_2014_save':dict(turnstile_types,date_time='datetime',
+                                      time_since_last='timedelta',entry_diff='float64'),
+           '2014_hourly':hourly_types,
+           '2015_hourly_combined':hourly_types,
+           'hourly_2015_locations':dict(hourly_types,station_id='int64'),
+           'hourly_2015_nbhd_locations':dict(hourly_types,station_id='int64',nta_id='str'),
+           'hourly_2014_nbhd_locations':{'nta_id':'str','date_time':'datetime',
+                                         'entries':'float64'},
+           'uber-*':{'Date/Time':'datetime:' + time_keys.uber_format,'Lat':'float64',
+                     'Lon':'float64','Base':'str','nta':'str'},
+           '2014_combined_final':{'nta':'str','date_hour':'datetime','rides':'int64',
+                                  'entries':'float64','month':'int64','day':'int64',
+                                  'hour':'int64'},
+           '2014_manhattan_classified':{'nta':'str','date_hour':'datetime','rides':'int64',
+                                        'entries':'float64','month':'int64','day':'int64',
+                                        'hour':'int64','classification':'int64',
+                                        'week_day':'int64'},
+           '2015_nta_hourly':{'nta':'str','date_hour':'datetime','rides':'float64'}}
+
+formats = ['.parquet','.feather','.csv']
+
+# Each schema type's pandas dtype and pyarrow type
+pandas_types = {'str':object,'int64':np.int64,'float64':np.float64}
+if pa is not None:
+    arrow_types = {'str':pa.string(),'int64':pa.int64(),'float64':pa.float64(),
+                   'datetime':pa.timestamp('ns'),'timedelta':pa.duration('ns')}
+
+
+# This function returns the schema of the data set saved at path
+def schema_for(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    for pattern,schema in schemas.items():
+        if fnmatch.fnmatch(name,pattern):
+            return schema
+    return {}
+
+
+# This function raises an error if pyarrow isn't installed
+def _require_pyarrow(path):
+    if pa is None:
+        raise ImportError('pyarrow is needed to save or load %s' % path)
+
+
+# This function returns path if it exists, otherwise the same data set saved in
+# one of the other formats
+def resolve(path):
+    if os.path.exists(path):
+        return path
+    stem = os.path.splitext(path)[0]
+    for ext in formats:
+        if os.path.exists(stem + ext):
+            return stem + ext
+    raise IOError('No such data set: %s' % path)
+
+
+# This function converts the columns of df to the types in schema
+def conform(df,schema):
+    df = df.copy()
+    for col,kind in schema.items():
+        if col not in df.columns:
+            continue
+        kind, _, format = kind.partition(':')
+        if kind == 'datetime':
+            if not pd.api.types.is_datetime64_any_dtype(df[col]):
+                df[col] = pd.to_datetime(df[col],format=format or None,errors='raise')
+        elif kind == 'timedelta':
+            if not pd.api.types.is_timedelta64_dtype(df[col]):
+                df[col] = pd.to_timedelta(df[col],errors='raise')
+        elif kind == 'str':
+            # Object columns can hold numbers (i.e. a linename of 45.0), so
+            # check the values themselves rather than the dtype
+            if pd.api.types.infer_dtype(df[col],skipna=True) != 'string':
+                df[col] = df[col].astype(str).where(df[col].notnull(),None)
+        else:
+            df[col] = df[col].astype(pandas_types[kind])
+    return df
+
+
+# This function returns the pyarrow schema of df with the schema's types
+def _arrow_schema(df,schema):
+    fields = []
+    for field in pa.Schema.from_pandas(df,preserve_index=False):
+        if field.name in schema:
+            field = pa.field(field.name,arrow_types[schema[field.name].partition(':')[0]])
+        fields.append(field)
+    return pa.schema(fields)
+
+
+# This function returns the rows of df that match every filter. A filter is
+# (column, op, value) with op one of ==, !=, <, <=, >, >=, in, or not in, the
+# same as pyarrow's filters.
+def apply_filters(df,filters):
+    mask = np.ones(len(df),dtype=bool)
+    for col,op,value in filters or []:
+        values = df[col]
+        if op in ('=','=='):
+            mask &= (values == value).values
+        elif op == '!=':
+            mask &= (values != value).values
+        elif op == '<':
+            mask &= (values < value).values
+        elif op == '<=':
+            mask &= (values <= value).values
+        elif op == '>':
+            mask &= (values > value).values
+        elif op == '>=':
+            mask &= (values >= value).values
+        elif op == 'in':
+            mask &= values.isin(value).values
+        elif op == 'not in':
+            mask &= ~values.isin(value).values
+        else:
+            raise ValueError('Unknown filter operator: %s' % op)
+    return df[mask].reset_index(drop=True) if filters else df
+
+
+# This class saves a data set in chunks (i.e. one chunk of rides at a time).
+# Each chunk of a Parquet file becomes its own row group(s). Call close after
+# the last chunk.
+class Writer(object):
+    def __init__(self,path,schema=None,row_group_size=250000):
+        self.path = path
+        self.schema = schema if schema is not None else schema_for(path)
+        self.row_group_size = row_group_size
+        self.ext = os.path.splitext(path)[1]
+        if self.ext not in formats:
+            raise ValueError('Unknown format: %s' % path)
+        if self.ext != '.csv':
+            _require_pyarrow(path)
+        # Saving replaces the whole data set, including every part of a folder
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        self.writer = None
+        self.arrow_schema = None
+        self.tables = []
+        self.header = True
+
+    def write(self,df):
+        df = conform(df,self.schema)
+        if self.ext == '.csv':
+            df.to_csv(self.path,mode='w' if self.header else 'a',header=self.header,index=False)
+            self.header = False
+            return
+        # Every chunk is saved with the types of the first chunk, so a column
+        # that is empty in a later chunk doesn't change type
+        if self.arrow_schema is None:
+            self.arrow_schema = _arrow_schema(df,self.schema)
+        table = pa.Table.from_pandas(df,schema=self.arrow_schema,preserve_index=False)
+        if self.ext == '.feather':
+            # Feather files can't be appended to, so the chunks are saved
+            # together when the writer is closed
+            self.tables.append(table)
+            return
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path,table.schema,compression='zstd')
+        self.writer.write_table(table,row_group_size=self.row_group_size)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.tables:
+            feather.write_feather(pa.concat_tables(self.tables),self.path,compression='lz4')
+            self.tables = []
+
+
+# This function saves df to path, in the format of path's extension
+def save(df,path,schema=None,row_group_size=250000):
+    writer = Writer(path,schema,row_group_size)
+    writer.write(df)
+    writer.close()
+
+
+# This function returns the part files of a data set folder, in order
+def _parts(path):
+    return sorted(glob.glob(os.path.join(path,'part-*' + os.path.splitext(path)[1])))
+
+
+# This function adds the rows of df to the end of the data set saved at path
+# (or saves them if it doesn't exist yet). A csv is appended to. A Parquet or
+# Feather data set becomes a folder of part files (the file that was saved
+# before is moved into it as the first part) and df is saved as the next part,
+# so the cost only depends on the size of df. If part is given the part file is
+# named after it (i.e. the week the rows came from) and replaces a part with the
+# same name, so appending the same rows again doesn't duplicate them. Parts are
+# loaded in the order of their names.
+def append(df,path,schema=None,part=None):
+    schema = schema if schema is not None else schema_for(path)
+    ext = os.path.splitext(path)[1]
+    if not os.path.exists(path) and (ext == '.csv' or part is None):
+        save(df,path,schema)
+    elif ext == '.csv':
+        conform(df,schema).to_csv(path,mode='a',header=False,index=False)
+    else:
+        if os.path.isfile(path):
+            tmp_path = path + '.tmp'
+            os.rename(path,tmp_path)
+            os.makedirs(path)
+            os.rename(tmp_path,os.path.join(path,'part-00000' + ext))
+        elif not os.path.exists(path):
+            os.makedirs(path)
+        if part is None:
+            part = '%05d' % len(_parts(path))
+        # Save to a temporary file first so a crash while saving never leaves a
+        # partial part that looks valid
+        part_path = os.path.join(path,'part-%s%s' % (part,ext))
+        tmp_path = os.path.join(path,'tmp-%s%s' % (part,ext))
+        save(df,tmp_path,schema)
+        os.rename(tmp_path,part_path)
+
+
+# This function loads the data set saved at path (see resolve). Only the given
+# columns are read, and only the rows that match filters (see apply_filters)
+# are kept. For Parquet files, row groups whose statistics don't match the
+# filters are never read.
+def load(path,columns=None,filters=None,schema=None):
+    path = resolve(path)
+    schema = schema if schema is not None else schema_for(path)
+    ext = os.path.splitext(path)[1]
+    if ext == '.csv':
+        dtype = dict((col,pandas_types[kind]) for col,kind in schema.items()
+                     if kind in ('str','float64'))
+        df = pd.read_csv(path,usecols=columns,dtype=dtype)
+        return apply_filters(conform(df,schema),filters)
+    _require_pyarrow(path)
+    paths = _parts(path) if os.path.isdir(path) else [path]
+    if ext == '.parquet':
+        tables = [pq.read_table(part,columns=columns,filters=filters or None) for part in paths]
+        return pa.concat_tables(tables).to_pandas()
+    df = pa.concat_tables([feather.read_table(part,columns=columns) for part in paths]).to_pandas()
+    return apply_filters(df,filters)
+
+
+# This function saves the data set at path (or a filtered selection of its
+# columns and rows) to a csv, i.e. for Tableau. Datetimes are written like
+# 2014-04-01 00:00:00.
+def export_csv(path,csv_path,columns=None,filters=None):
+    df = load(path,columns,filters)
+    df.to_csv(csv_path,index=False,date_format='%Y-%m-%d %H:%M:%S')
+    return csv_path
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert a data set between Parquet, Feather, and csv')
+    parser.add_argument('source',help='data set to read')
+    parser.add_argument('dest',help='file to write (the format is picked from its extension)')
+    parser.add_argument('--columns',nargs='+',default=None,help='only keep these columns')
+    args = parser.parse_args()
+    if os.path.splitext(args.dest)[1] == '.csv':
+        export_csv(args.source,args.dest,args.columns)
+    else:
+        save(load(args.source,args.columns),args.dest,schema_for(args.source))
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+import pipeline_io
+
+'''
+This module joins our data sets as a star schema instead of merging them into
+one wide DataFrame. The fact table has one row per neighborhood and hour, and
+stores the neighborhood as an integer code into the neighborhood dimension and
+the hour as an integer index into the hour dimension, along with the measures
+for that row (i.e. rides and entries). Data that only depends on the
+neighborhood (census) or only on the hour (weather, month/day/hour) is kept once
+per neighborhood or hour in the dimension tables, and is only copied onto the
+fact rows (by gathering with the codes) when a feature matrix or DataFrame is
+built.
+'''
+
+
+class StarSchema(object):
+
+    # ntas is the neighborhood of each neighborhood code and hours is the hour
+    # key of each hour index. nta_codes and hour_index are the neighborhood
+    # code and hour index of each fact row, and measures is a dictionary of
+    # arrays with one value for each fact row.
+    def __init__(self,ntas,hours,nta_codes,hour_index,measures=None,
+                 nta_dim=None,hour_dim=None):
+        self.ntas = np.asarray(ntas,dtype=object)
+        self.hours = np.asarray(hours,dtype=np.int64)
+        self.nta_codes = np.asarray(nta_codes,dtype=np.int32)
+        self.hour_index = np.asarray(hour_index,dtype=np.int32)
+        self.measures = dict(measures or {})
+        # The dimension tables have one row for each neighborhood code and hour
+        # index, in that order
+        self.nta_dim = nta_dim if nta_dim is not None else pd.DataFrame(index=np.arange(len(self.ntas)))
+        self.hour_dim = hour_dim if hour_dim is not None else pd.DataFrame(index=np.arange(len(self.hours)))
+
+    # This function builds a star schema from a panel (see panel.py) with a row
+    # for every neighborhood and hour. The other columns of the panel become
+    # measures.
+    @classmethod
+    def from_panel(cls,counts,entity_col,hour_col='hour_key'):
+        nta_codes,ntas = pd.factorize(counts[entity_col],sort=True)
+        hour_index,hours = pd.factorize(counts[hour_col],sort=True)
+        measures = {col:counts[col].values for col in counts.columns
+                    if col not in (entity_col,hour_col)}
+        return cls(ntas,hours,nta_codes,hour_index,measures)
+
+    # The number of fact rows
+    def __len__(self):
+        return len(self.nta_codes)
+
+    # This function adds a measure from grouped data that only has rows for
+    # some neighborhoods and hours (i.e. turnstile entries). Fact rows that
+    # aren't in counts get fill_value.
+    def add_measure(self,name,counts,entity_col,hour_col='hour_key',fill_value=0):
+        nta_codes = pd.Index(self.ntas).get_indexer(counts[entity_col])
+        hour_index = pd.Index(self.hours).get_indexer(counts[hour_col])
+        found = (nta_codes >= 0) & (hour_index >= 0)
+        # Look up each count's fact row by its position in a (code, index) grid
+        cells = np.full(len(self.ntas)*len(self.hours),-1,dtype=np.int64)
+        cells[self.nta_codes.astype(np.int64)*len(self.hours) + self.hour_index] = np.arange(len(self))
+        rows = cells[nta_codes[found].astype(np.int64)*len(self.hours) + hour_index[found]]
+        values = np.full(len(self),fill_value,dtype=np.result_type(counts[name].dtype,type(fill_value)))
+        values[rows[rows >= 0]] = counts[name].values[found][rows >= 0]
+        self.measures[name] = values
+
+    # This function adds the columns of table, which has one row per
+    # neighborhood in its key column, to the neighborhood dimension.
+    # Neighborhoods that aren't in table get NaN.
+    def add_nta_dimension(self,table,key):
+        table = table.drop_duplicates(key).set_index(key).reindex(self.ntas)
+        for col in table.columns:
+            self.nta_dim[col] = table[col].values
+
+    # This function adds the columns of table, which has one row per hour key
+    # in its key column, to the hour dimension. Hours that aren't in table get
+    # NaN.
+    def add_hour_dimension(self,table,key='hour_key'):
+        table = table.drop_duplicates(key).set_index(key).reindex(self.hours)
+        for col in table.columns:
+            self.hour_dim[col] = table[col].values
+
+    # This function returns the values of a measure or dimension column for
+    # each fact row. 'nta' and 'hour_key' return each row's neighborhood and
+    # hour key.
+    def column(self,name):
+        if name == 'nta':
+            return self.ntas[self.nta_codes]
+        if name == 'hour_key':
+            return self.hours[self.hour_index]
+        if name in self.measures:
+            return self.measures[name]
+        if name in self.nta_dim:
+            return self.nta_dim[name].values[self.nta_codes]
+        if name in self.hour_dim:
+            return self.hour_dim[name].values[self.hour_index]
+        raise KeyError(name)
+
+    # This function returns every column name, in the order of the fact
+    # table's keys and measures, then the hour dimension, then the neighborhood
+    # dimension
+    def columns(self):
+        return (['nta','hour_key'] + list(self.measures) +
+                list(self.hour_dim.columns) + list(self.nta_dim.columns))
+
+    # This function returns a new star schema with only the fact rows where
+    # mask is True (or, if mask is a slice, the rows in the slice, which are
+    # views instead of copies). The dimension tables are shared.
+    def select(self,mask):
+        if not isinstance(mask,slice):
+            mask = np.asarray(mask,dtype=bool)
+        return StarSchema(self.ntas,self.hours,self.nta_codes[mask],self.hour_index[mask],
+                          {name:values[mask] for name,values in self.measures.items()},
+                          self.nta_dim,self.hour_dim)
+
+    # This function gathers the given (numeric) columns into a 2D feature
+    # matrix with one row per fact row
+    def feature_matrix(self,columns,dtype=np.float64):
+        X = np.empty((len(self),len(columns)),dtype=dtype)
+        for i,name in enumerate(columns):
+            X[:,i] = self.column(name)
+        return X
+
+    # This function gathers the given columns (default all of them) into a
+    # DataFrame with one row per fact row
+    def to_frame(self,columns=None):
+        if columns is None:
+            columns = self.columns()
+        return pd.DataFrame({name:self.column(name) for name in columns},columns=columns)
+
+    # This function saves the given columns (default all of them) to path, in
+    # the format of its extension (see pipeline_io.py). Only chunksize fact rows
+    # are gathered into a DataFrame at a time.
+    def save(self,path,columns=None,chunksize=500000):
+        if columns is None:
+            columns = self.columns()
+        writer = pipeline_io.Writer(path)
+        for start in range(0,max(len(self),1),chunksize):
+            writer.write(self.select(slice(start,start + chunksize)).to_frame(columns))
+        writer.close()
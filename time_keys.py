@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+'''
+This module converts timestamps into integer hour keys, which we join our Uber,
+weather, and turnstile data on instead of formatted date strings. A key is the
+number of hours since 1/1/1970 (in local time, like the timestamps themselves),
+so every timestamp in the same hour gets the same key and consecutive hours have
+consecutive keys.
+'''
+
+# The format of the Date/Time column of the raw Uber data (i.e. 4/1/2014 0:11:00)
+uber_format = '%m/%d/%Y %H:%M:%S'
+# The format of the date_time columns we save (i.e. 2014-04-01 00:00:00)
+iso_format = '%Y-%m-%d %H:%M:%S'
+
+
+# This function parses timestamps (strings in the given format, or datetimes)
+# and returns the hour key of each one as an int64 array. Timestamps that can't
+# be parsed and missing timestamps (NaT) raise an error.
+def hour_keys(times,format=iso_format):
+    if not np.issubdtype(np.asarray(times).dtype,np.datetime64):
+        times = pd.to_datetime(times,format=format)
+    times = np.asarray(times,dtype='datetime64[ns]')
+    if np.isnat(times).any():
+        raise ValueError('%d timestamps are missing (NaT)' % np.isnat(times).sum())
+    return times.astype('datetime64[h]').astype(np.int64)
+
+
+# This function returns the datetime64 of the start of each key's hour
+def key_times(keys):
+    return np.asarray(keys,dtype=np.int64).astype('datetime64[h]')
+
+
+# This function returns each key's hour formatted like our date_hour columns
+# (i.e. 2014-04-01 00:00:00)
+def key_strings(keys):
+    return np.asarray(pd.Series(key_times(keys).astype('datetime64[ns]')).dt.strftime(iso_format),dtype=object)
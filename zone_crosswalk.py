@@ -0,0 +1,150 @@
+import glob
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse
+import shapely
+import shapely.geometry
+from shapely.strtree import STRtree
+import nta_locator
+
+'''
+This module converts counts for the TLC taxi zones (the LocationID of the 2015
+Uber data) into counts for NTAs (the neighborhoods of the 2014 data), so both
+years can be modeled at the same level. The crosswalk is a sparse matrix with
+one row per taxi zone and one column per NTA, where each entry is the share of
+the zone's area that lies in the NTA:
+
+  weight[zone, nta] = area(zone & nta) / area(zone & any nta)
+
+so every zone's rides are split between the NTAs it overlaps in proportion to
+their area, and no rides are lost. Zones that don't overlap any NTA (like
+Newark Airport) get a row of zeros. Converting a table of zone counts to NTA
+counts is then one sparse matrix multiply.
+
+The crosswalk only has to be built once. It is saved with scipy.sparse.save_npz
+in path, and the zone ids and NTA codes of its rows and columns in
+<path>_labels.npz, along with the sha1 of the taxi zone shapefile and of the NTA
+shapes it was built from. It is rebuilt whenever either file changes.
+'''
+
+# The default location of the saved crosswalk
+crosswalk_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),'zone_nta_crosswalk.npz')
+
+
+# This function reads the TLC taxi zone shapefile and returns a list of the
+# zones' shapes in longitude/latitude and a list of their LocationIDs. It needs
+# fiona.
+def load_zone_shapes(path):
+    import fiona
+    import fiona.transform
+    polygons = []
+    zone_ids = []
+    with fiona.open(path) as shapefile:
+        for record in shapefile:
+            # The zones are saved in feet on the New York State Plane, so
+            # reproject them to longitude/latitude like our NTA shapes
+            geometry = fiona.transform.transform_geom(shapefile.crs,'EPSG:4326',record['geometry'])
+            polygons.append(shapely.geometry.shape(geometry))
+            zone_ids.append(int(record['properties']['LocationID']))
+    return polygons, zone_ids
+
+
+# This function puts shapes in an object array one at a time, so numpy doesn't
+# try to turn the shapes themselves into arrays
+def _object_array(shapes):
+    shapes = list(shapes)
+    array = np.empty(len(shapes),dtype=object)
+    array[:] = shapes
+    return array
+
+
+# This function computes the crosswalk between the zones and the NTAs. It
+# returns the weight matrix, and the zone ids and NTA codes of its rows and
+# columns. Some zones are made of more than one shape with the same id (i.e.
+# zones 56 and 103 in taxi_zones.shp), so the overlaps of every shape of a zone
+# are added up into a single row per zone id.
+def build_crosswalk(zone_polygons,zone_ids,nta_polygons,nta_codes):
+    # Some shapes have small self-intersections, which have to be fixed before
+    # we can intersect them
+    zone_polygons = shapely.make_valid(_object_array(zone_polygons))
+    nta_polygons = shapely.make_valid(_object_array(nta_polygons))
+    # Get every (zone, NTA) pair whose shapes overlap, and the area of their
+    # overlap. The areas are in square degrees, which only differ from the
+    # true areas by a factor that is the same across a single zone.
+    zones, ntas = STRtree(nta_polygons).query(zone_polygons,predicate='intersects')
+    areas = shapely.area(shapely.intersection(zone_polygons[zones],nta_polygons[ntas]))
+    keep = areas > 0
+    zones = zones[keep]
+    ntas = ntas[keep]
+    areas = areas[keep]
+    # Get the row of each shape's zone id
+    zone_ids, rows = np.unique(np.asarray(zone_ids),return_inverse=True)
+    rows = rows.ravel()[zones]
+    totals = np.bincount(rows,weights=areas,minlength=len(zone_ids))
+    # The overlaps of a zone's shapes with the same NTA are summed into one
+    # entry
+    weights = scipy.sparse.csr_matrix((areas/totals[rows],(rows,ntas)),
+                                      shape=(len(zone_ids),len(nta_polygons)))
+    weights.sum_duplicates()
+    return weights, zone_ids, np.asarray(nta_codes,dtype=str)
+
+
+# This function saves a crosswalk. sources is the sha1 of each file it was
+# built from (see source_hashes).
+def save_crosswalk(weights,zone_ids,nta_codes,path=crosswalk_path,sources=None):
+    scipy.sparse.save_npz(path,weights)
+    np.savez(_labels_path(path),zone_ids=zone_ids,nta_codes=nta_codes,
+             **dict(sources or {}))
+
+
+# This function loads a saved crosswalk. It returns the weight matrix, and the
+# zone ids and NTA codes of its rows and columns.
+def load_crosswalk(path=crosswalk_path):
+    weights = scipy.sparse.load_npz(path)
+    labels = np.load(_labels_path(path))
+    return weights, labels['zone_ids'], labels['nta_codes']
+
+
+# This function returns the path of a crosswalk's labels file
+def _labels_path(path):
+    return path[:-len('.npz')] + '_labels.npz'
+
+
+# This function returns the sha1 of the taxi zone shapefile (all of its files,
+# since the LocationIDs are in the .dbf) and of the NTA shapes
+def source_hashes(zones_path,shapes_path):
+    zone_files = sorted(glob.glob(os.path.splitext(zones_path)[0] + '.*'))
+    zones_hash = '-'.join(nta_locator._file_hash(f) for f in zone_files)
+    return {'zones_hash':zones_hash,'shapes_hash':nta_locator._file_hash(shapes_path)}
+
+
+# This function returns True if the crosswalk at path was built from the files
+# with the given hashes
+def _is_current(path,sources):
+    if not (os.path.exists(path) and os.path.exists(_labels_path(path))):
+        return False
+    labels = np.load(_labels_path(path))
+    return all(name in labels and str(labels[name]) == value for name,value in sources.items())
+
+
+# This function loads the crosswalk, first building it from the taxi zone
+# shapefile and the NTA shapes if it hasn't been saved yet or either file has
+# changed since it was saved
+def get_crosswalk(zones_path,path=crosswalk_path,shapes_path=nta_locator.shapes_path):
+    sources = source_hashes(zones_path,shapes_path)
+    if not _is_current(path,sources):
+        zone_polygons, zone_ids = load_zone_shapes(zones_path)
+        nta_polygons, nta_codes = nta_locator.load_shapes(shapes_path)
+        save_crosswalk(*build_crosswalk(zone_polygons,zone_ids,nta_polygons,nta_codes),
+                       path=path,sources=sources)
+    return load_crosswalk(path)
+
+
+# This function converts a DataFrame of counts with one column per zone id
+# (i.e. one row per hour) into a DataFrame with one column per NTA code. Zones
+# that aren't in the crosswalk are dropped.
+def zones_to_ntas(counts,weights,zone_ids,nta_codes):
+    counts = counts.reindex(columns=zone_ids,fill_value=0)
+    nta_counts = weights.T.dot(counts.values.T.astype(float)).T
+    return pd.DataFrame(nta_counts,index=counts.index,columns=nta_codes)